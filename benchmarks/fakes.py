@@ -0,0 +1,398 @@
+"""Local stand-ins for Channel Access, CATAP and SimFrame.
+
+They implement just the calls the plugins make, with configurable latency, so
+the hot paths can be timed off the machine. ``install_*`` registers them in
+``sys.modules`` and must run before the plugin modules are imported.
+"""
+
+import os
+import sys
+import time
+import types
+import threading
+import h5py
+import numpy as np
+from images import synthetic_image
+
+
+class FakeCA:
+    """In-process PV store with per-request latency.
+
+    Camera ``ArrayData`` PVs serve a rotating set of synthetic frames; magnet
+    ``READI`` readbacks relax exponentially towards the last ``SETI`` write.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.002,
+        frame_shape: tuple[int, int] = (480, 640),
+        frames: int = 4,
+        settle_time: float = 0.02,
+    ):
+        self.latency = latency
+        self.settle_time = settle_time
+        self.values = {}
+        self._frame_index = 0
+        self._setpoints = {}
+        # Reentrant: a SETI write reads the current READI under the same lock
+        self._lock = threading.RLock()
+        self.set_frame_shape(frame_shape, frames)
+
+    def set_frame_shape(self, shape: tuple[int, int], frames: int = 4):
+        self.frame_shape = shape
+        self._frames = [synthetic_image(shape, seed=seed).ravel() for seed in range(frames)]
+
+    def _read(self, pvname: str):
+        if pvname.endswith(":CAM2:ArrayData"):
+            with self._lock:
+                self._frame_index = (self._frame_index + 1) % len(self._frames)
+                return self._frames[self._frame_index].copy()
+        if pvname.endswith(":CAM2:ArraySize0_RBV"):
+            return self.frame_shape[1]
+        if pvname.endswith(":CAM2:ArraySize1_RBV"):
+            return self.frame_shape[0]
+        if pvname.endswith(":CAM:ScaleFactor"):
+            return self.values.get(pvname, 1)
+        if pvname.endswith(":READI"):
+            setpoint = pvname[: -len("READI")] + "SETI"
+            with self._lock:
+                if setpoint not in self._setpoints:
+                    return self.values.get(setpoint, 0.0)
+                previous, target, written = self._setpoints[setpoint]
+            decay = np.exp(-(time.monotonic() - written) / self.settle_time)
+            return target + (previous - target) * decay
+        return self.values.get(pvname, 0.0)
+
+    def get(self, pvname: str):
+        time.sleep(self.latency)
+        return self._read(pvname)
+
+    def get_many(self, pvnames: list[str]):
+        # One round trip for the whole batch
+        time.sleep(self.latency)
+        return [self._read(pvname) for pvname in pvnames]
+
+    def put(self, pvname: str, value):
+        time.sleep(self.latency)
+        with self._lock:
+            if pvname.endswith(":SETI"):
+                previous = self._read(pvname[: -len("SETI")] + "READI")
+                self._setpoints[pvname] = (previous, value, time.monotonic())
+            self.values[pvname] = value
+
+    def module(self) -> types.ModuleType:
+        ca = self
+
+        class PV:
+            def __init__(self, pvname, auto_monitor=None, callback=None, count=None, **kwargs):
+                self.pvname = pvname
+                self.connected = True
+                self._callbacks = [callback] if callback else []
+
+            def get(self, count=None, as_numpy=True, timeout=None, use_monitor=True, **kwargs):
+                return ca.get(self.pvname)
+
+            def put(self, value, wait=False, **kwargs):
+                ca.put(self.pvname, value)
+
+            def add_callback(self, callback, **kwargs):
+                self._callbacks.append(callback)
+
+            def clear_callbacks(self):
+                self._callbacks = []
+
+            def disconnect(self):
+                self.connected = False
+
+        module = types.ModuleType("epics")
+        module.PV = PV
+        module.caget = lambda pvname, **kwargs: ca.get(pvname)
+        module.caput = lambda pvname, value, **kwargs: ca.put(pvname, value)
+        module.caget_many = lambda pvnames, **kwargs: ca.get_many(pvnames)
+        return module
+
+
+def install_epics(ca: FakeCA):
+    sys.modules["epics"] = ca.module()
+
+
+class _Element:
+    """CATAP hardware object whose attributes read and write ``<name>:<ATTRIBUTE>`` PVs."""
+
+    def __init__(self, ca: FakeCA, name: str):
+        object.__setattr__(self, "_ca", ca)
+        object.__setattr__(self, "name", name)
+
+    def __getattr__(self, attribute):
+        return self._ca.get(f"{self.name}:{attribute.upper()}")
+
+    def __setattr__(self, attribute, value):
+        self._ca.put(f"{self.name}:{attribute.upper()}", value)
+
+
+class _Laser:
+    def __init__(self):
+        self.shutters_open = True
+
+    def open_shutters(self):
+        self.shutters_open = True
+
+    def close_shutters(self):
+        self.shutters_open = False
+
+
+def install_catap(ca: FakeCA, connect_time: float = 0.0):
+    """Register ``CATAP`` factory modules whose hardware is backed by ``ca``."""
+
+    def factory(laser=False):
+        class Factory:
+            def __init__(self, is_virtual=False, areas=None):
+                time.sleep(connect_time)
+                self.areas = areas
+                self._laser = _Laser()
+
+            def get_hardware(self, name):
+                return self._laser if laser else _Element(ca, name)
+
+        return Factory
+
+    modules = {
+        "CATAP.magnet": {"MagnetFactory": factory()},
+        "CATAP.diagnostics.camera": {"CameraFactory": factory()},
+        "CATAP.diagnostics.charge": {"ChargeFactory": factory()},
+        "CATAP.laser.pi_laser": {"PILaserFactory": factory(laser=True)},
+    }
+    for package in ("CATAP", "CATAP.diagnostics", "CATAP.laser"):
+        module = types.ModuleType(package)
+        module.__path__ = []
+        sys.modules[package] = module
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class FakeBeam:
+    """Particle distribution read from a synthetic beam file.
+
+    Like SimFrame's beam properties, each statistic is computed on its own from
+    the particle arrays on every access. They are written out per attribute with
+    plain numpy, independently of the plugin's ``beam_statistics``, so that the
+    two paths can be compared.
+    """
+
+    _particles = ("x", "y", "z", "t", "cpx", "cpy", "cpz", "charge")
+    rest_energy = 510998.95
+
+    def __init__(self):
+        self.filename = None
+        self._data = {}
+        self.Q = None
+
+    def read_HDF5_beam_file(self, filename):
+        with h5py.File(filename, "r") as f:
+            self._data = {name: f[name][()] for name in self._particles}
+            self.Q = float(f.attrs["Q"])
+        self.filename = filename
+
+    def __getitem__(self, key):
+        if key == "filename":
+            return self.filename
+        return self._data[key]
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._data:
+            raise AttributeError(name)
+        return self._data[name]
+
+    def _mean(self, a):
+        return np.average(a, weights=self._data["charge"])
+
+    def _cov(self, a, b):
+        return self._mean((a - self._mean(a)) * (b - self._mean(b)))
+
+    def _emittance(self, a, b):
+        return np.sqrt(self._cov(a, a) * self._cov(b, b) - self._cov(a, b) ** 2)
+
+    @property
+    def cp(self):
+        return np.sqrt(self.cpx**2 + self.cpy**2 + self.cpz**2)
+
+    @property
+    def sigma_x(self):
+        return np.sqrt(self._cov(self.x, self.x))
+
+    @property
+    def sigma_y(self):
+        return np.sqrt(self._cov(self.y, self.y))
+
+    @property
+    def sigma_z(self):
+        return np.sqrt(self._cov(self.z, self.z))
+
+    @property
+    def sigma_t(self):
+        return np.sqrt(self._cov(self.t, self.t))
+
+    @property
+    def sigma_cp(self):
+        return np.sqrt(self._cov(self.cp, self.cp))
+
+    @property
+    def mean_cp(self):
+        return self._mean(self.cp)
+
+    @property
+    def mean_energy(self):
+        return self._mean(np.sqrt(self.cp**2 + self.rest_energy**2))
+
+    @property
+    def momentum_spread(self):
+        return self.sigma_cp / self.mean_cp
+
+    @property
+    def enx(self):
+        return self._emittance(self.x, self.cpx / self.rest_energy)
+
+    @property
+    def eny(self):
+        return self._emittance(self.y, self.cpy / self.rest_energy)
+
+    @property
+    def beta_x(self):
+        return self._cov(self.x, self.x) / self._emittance(self.x, self.cpx / self.cpz)
+
+    @property
+    def beta_y(self):
+        return self._cov(self.y, self.y) / self._emittance(self.y, self.cpy / self.cpz)
+
+    @property
+    def alpha_x(self):
+        xp = self.cpx / self.cpz
+        return -self._cov(self.x, xp) / self._emittance(self.x, xp)
+
+    @property
+    def alpha_y(self):
+        yp = self.cpy / self.cpz
+        return -self._cov(self.y, yp) / self._emittance(self.y, yp)
+
+    @property
+    def linear_chirp_z(self):
+        return self._cov(self.z, self.cp) / self._cov(self.z, self.z) / self.mean_cp
+
+    @property
+    def peak_current(self):
+        hist, edges = np.histogram(self.t, bins=64, weights=self._data["charge"])
+        return hist.max() / (edges[1] - edges[0])
+
+
+class FakeLattice:
+    def __init__(self, name: str, elements: dict):
+        self.name = name
+        self.elements = elements
+        self.groups = {}
+        self.prefix = None
+        self.sample_interval = 1
+
+
+class FakeFramework:
+    """Lattice of a few sections, each with quadrupoles and one screen at its end.
+
+    ``track`` sleeps ``track_time`` per section and writes a Gaussian beam file
+    for each screen, with ``particles / sample_interval`` macro-particles.
+    """
+
+    sections = ("injector", "L01", "S02", "L02")
+    quadrupoles = 4
+    particles = 2**16
+    track_time = 0.01
+
+    def __init__(self, directory=".", verbose=False):
+        self.directory = directory
+        self.subdirectory = directory
+        self.generator = types.SimpleNamespace(charge=250e-12, number_of_particles=self.particles)
+        self.lines = list(self.sections)
+        self._lattices = {
+            line: FakeLattice(
+                line,
+                {f"{line}-QUAD{i:02d}": {"k1l": 0.0} for i in range(1, self.quadrupoles + 1)}
+                | {f"{line}-SCR": {}},
+            )
+            for line in self.lines
+        }
+        self.elements = {
+            name: params for lattice in self._lattices.values() for name, params in lattice.elements.items()
+        }
+        self.groups = {}
+
+    def loadSettings(self, filename):
+        pass
+
+    def change_Lattice_Code(self, *args, **kwargs):
+        pass
+
+    def setSubDirectory(self, directory):
+        self.subdirectory = directory
+
+    def __getitem__(self, name):
+        return self._lattices[name]
+
+    def getElement(self, name, param):
+        return self.elements[name].get(param, 0.0)
+
+    def modifyElement(self, name, param, value):
+        self.elements[name][param] = value
+
+    def track(self, startfile=None, endfile=None):
+        lines = self.lines[self.lines.index(startfile) : self.lines.index(endfile) + 1]
+        n = max(16, self.particles // max(1, int(self._lattices[self.lines[0]].sample_interval)))
+        rng = np.random.default_rng(0)
+        for line in lines:
+            time.sleep(self.track_time)
+            focusing = sum(self.elements[f"{line}-QUAD{i:02d}"]["k1l"] for i in range(1, self.quadrupoles + 1))
+            scale = 1e-3 * (1.0 + 0.1 * np.tanh(focusing))
+            with h5py.File(os.path.join(self.subdirectory, f"{line}-SCR.openpmd.hdf5"), "w") as f:
+                f.attrs["Q"] = self.generator.charge
+                f["x"] = rng.normal(0, scale, n)
+                f["y"] = rng.normal(0, scale / (1.0 + 0.1 * np.tanh(focusing)), n)
+                f["z"] = rng.normal(0, 1e-3, n)
+                f["t"] = f["z"][()] / 3e8
+                f["cpx"] = rng.normal(0, 1e3, n)
+                f["cpy"] = rng.normal(0, 1e3, n)
+                f["cpz"] = rng.normal(35e6, 1e4, n)
+                f["charge"] = np.full(n, self.generator.charge / n)
+
+
+def _load_directory(directory, beams=True, framework=None):
+    loaded = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if entry.name.endswith(".hdf5"):
+            beam = FakeBeam()
+            beam.read_HDF5_beam_file(entry.path)
+            loaded.append(beam)
+    return types.SimpleNamespace(beams=loaded)
+
+
+def install_simframe(particles: int = 2**16, track_time: float = 0.01):
+    FakeFramework.particles = particles
+    FakeFramework.track_time = track_time
+    package = types.ModuleType("SimulationFramework")
+    package.__path__ = []
+    framework = types.ModuleType("SimulationFramework.Framework")
+    framework.Framework = FakeFramework
+    framework.load_directory = _load_directory
+    modules = types.ModuleType("SimulationFramework.Modules")
+    modules.__path__ = []
+    beams = types.ModuleType("SimulationFramework.Modules.Beams")
+    beams.beam = FakeBeam
+    package.Framework = framework
+    package.Modules = modules
+    modules.Beams = beams
+    sys.modules.update(
+        {
+            "SimulationFramework": package,
+            "SimulationFramework.Framework": framework,
+            "SimulationFramework.Modules": modules,
+            "SimulationFramework.Modules.Beams": beams,
+        }
+    )
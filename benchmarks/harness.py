@@ -0,0 +1,49 @@
+import time
+import tracemalloc
+import numpy as np
+
+
+def measure(name: str, func, repeats: int = 20, warmup: int = 2, items: int = 1, **params) -> dict:
+    """Time ``func()`` and report latency percentiles, throughput and peak memory.
+
+    Timings are taken without tracing; peak memory comes from one extra traced
+    call, so tracemalloc overhead does not distort the latencies. ``items`` is
+    the number of work units (frames, channels, evaluations) in one call.
+    """
+    for _ in range(warmup):
+        func()
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarise(name, times, items=items, peak_memory_bytes=peak, **params)
+
+
+def summarise(name: str, times, items: int = 1, peak_memory_bytes: int | None = None, **params) -> dict:
+    """Latency percentiles and throughput of a set of timings, in the report format."""
+    times = np.asarray(times, dtype=float)
+    mean = float(times.mean())
+    return {
+        "name": name,
+        "params": params,
+        "repeats": len(times),
+        "items": items,
+        "mean_s": mean,
+        "min_s": float(times.min()),
+        "p50_s": float(np.percentile(times, 50)),
+        "p90_s": float(np.percentile(times, 90)),
+        "p99_s": float(np.percentile(times, 99)),
+        "throughput_per_s": items / mean if mean > 0 else float("inf"),
+        "peak_memory_bytes": None if peak_memory_bytes is None else int(peak_memory_bytes),
+    }
+
+
+def skipped(name: str, reason: str, **params) -> dict:
+    return {"name": name, "params": params, "skipped": reason}
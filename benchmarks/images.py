@@ -0,0 +1,43 @@
+import numpy as np
+
+sizes = {
+    "small": (240, 320),
+    "vga": (480, 640),
+    "sxga": (1024, 1280),
+}
+noise_levels = (0.01, 0.05)
+
+
+def synthetic_image(
+    shape: tuple[int, int] = (480, 640),
+    sigma: tuple[float, float] | None = None,
+    noise: float = 0.01,
+    amplitude: float = 2000.0,
+    offset: float = 100.0,
+    seed: int = 0,
+    dtype=np.uint16,
+):
+    """Gaussian beam spot on a flat pedestal with Gaussian read noise.
+
+    ``sigma`` is (sigma_x, sigma_y) in pixels, defaulting to a spot a fortieth
+    of the frame; ``noise`` is the noise RMS as a fraction of ``amplitude``.
+    """
+    rng = np.random.default_rng(seed)
+    rows, columns = shape
+    if sigma is None:
+        sigma = (columns / 40, rows / 40)
+    x0 = columns / 2 + rng.uniform(-columns / 10, columns / 10)
+    y0 = rows / 2 + rng.uniform(-rows / 10, rows / 10)
+    x = np.arange(columns)
+    y = np.arange(rows)[:, None]
+    image = offset + amplitude * np.exp(
+        -((x - x0) ** 2) / (2 * sigma[0] ** 2) - (y - y0) ** 2 / (2 * sigma[1] ** 2)
+    )
+    image += rng.normal(0.0, noise * amplitude, shape)
+    return np.clip(image, 0, np.iinfo(dtype).max).astype(dtype)
+
+
+def background_image(shape=(480, 640), noise=0.01, amplitude=2000.0, offset=100.0, seed=1, dtype=np.uint16):
+    rng = np.random.default_rng(seed)
+    image = offset + rng.normal(0.0, noise * amplitude, shape)
+    return np.clip(image, 0, np.iinfo(dtype).max).astype(dtype)
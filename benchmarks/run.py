@@ -0,0 +1,312 @@
+"""Offline benchmarks for the CATAP and SimFrame plugin hot paths.
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py --quick --only otsu,fit -o new.json --compare results.json
+
+Channel Access, CATAP and SimFrame are replaced by the stand-ins in
+``fakes.py``; the Badger interface benchmarks still need ``badger`` and
+``pydantic`` and are reported as skipped without them. Results are written as
+JSON with the environment, so runs from different versions can be compared.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+import importlib.util
+from tempfile import TemporaryDirectory
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+catap_dir = os.path.join(root, "interfaces", "CATAP")
+simframe_dir = os.path.join(root, "interfaces", "SimFrame")
+sys.path[:0] = [here, root, catap_dir]
+
+import fakes  # noqa: E402
+from harness import measure, skipped, summarise  # noqa: E402
+from images import background_image, noise_levels, sizes, synthetic_image  # noqa: E402
+
+ca = fakes.FakeCA()
+fakes.install_epics(ca)
+fakes.install_catap(ca)
+fakes.install_simframe()
+
+import image_analysis  # noqa: E402
+import image_saving  # noqa: E402
+
+
+def load_plugin(name: str, directory: str):
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(directory, "__init__.py"), submodule_search_locations=[directory]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_otsu(quick: bool):
+    results = []
+    for size, shape in sizes.items():
+        for noise in noise_levels[:1] if quick else noise_levels:
+            image = synthetic_image(shape, noise=noise).astype(float)
+            results.append(
+                measure("otsu", lambda: image_analysis.otsu(image), repeats=10 if quick else 50, size=size, noise=noise)
+            )
+    return results
+
+
+def bench_fit(quick: bool):
+    results = []
+    for size, shape in sizes.items():
+        image = image_analysis.preprocess_image(synthetic_image(shape), background_image(shape))
+        if size != "sxga":
+            # The plain full-frame fit takes seconds on the largest frames
+            results.append(
+                measure(
+                    "fit_gaussian_beam_size",
+                    lambda: image_analysis.fit_gaussian_beam_size(image),
+                    repeats=3 if quick else 10,
+                    warmup=1,
+                    size=size,
+                )
+            )
+        for mode in image_analysis.fit_modes:
+            if mode == "full" and size == "sxga":
+                continue
+            results.append(
+                measure(
+                    "fit_beam",
+                    lambda: image_analysis.fit_beam(image, mode=mode),
+                    repeats=3 if quick else 10,
+                    warmup=1,
+                    size=size,
+                    mode=mode,
+                )
+            )
+    return results
+
+
+def bench_get_data_array(quick: bool):
+    results = []
+    for size, shape in sizes.items():
+        ca.set_frame_shape(shape)
+        camera = f"BENCH-CAM-{size.upper()}"
+        results.append(
+            measure(
+                "get_data_array",
+                lambda: image_saving.get_data_array(camera, scalefactor=1),
+                repeats=10 if quick else 50,
+                size=size,
+                latency_s=ca.latency,
+            )
+        )
+    return results
+
+
+def bench_set_values(quick: bool):
+    try:
+        catap = load_plugin("catap_interface", catap_dir)
+    except ImportError as e:
+        return [skipped("set_values", f"CATAP interface unavailable: {e}")]
+    results = []
+    for magnets in (1, 8):
+        interface = catap.Interface(poll_interval=0.005, settle_timeout={"magnet": 1.0})
+        channels = [f"magnet:BENCH-QUAD{i:02d}:seti" for i in range(magnets)]
+        step = iter(range(10**9))
+
+        def set_values():
+            value = float(next(step) % 2)
+            interface.set_values({channel: value for channel in channels})
+
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            results.append(
+                measure(
+                    "set_values",
+                    set_values,
+                    repeats=5 if quick else 20,
+                    items=magnets,
+                    magnets=magnets,
+                    latency_s=ca.latency,
+                    settle_time_s=ca.settle_time,
+                )
+            )
+    return results
+
+
+def bench_track(quick: bool):
+    try:
+        simframe = load_plugin("simframe_interface", simframe_dir)
+    except ImportError as e:
+        return [skipped("track", f"SimFrame interface unavailable: {e}")]
+    observables = [f"{line}-SCR:{param}" for line in ("S02", "L02") for param in ("sigma_x", "sigma_y", "enx")]
+    results = []
+    with TemporaryDirectory() as base_dir:
+        for lazy_beams in (True, False):
+            reference = None
+            for fast_statistics in (False, True):
+                interface = simframe.SimFrameInterface(
+                    base_dir=base_dir,
+                    settings_file="bench.def",
+                    cache_size=0,
+                    lazy_beams=lazy_beams,
+                    fast_statistics=fast_statistics,
+                )
+                step = iter(range(10**9))
+
+                def track():
+                    interface.set_values({"L01-QUAD01:k1l": float(next(step))})
+                    interface.track(observables)
+
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    result = measure(
+                        "track",
+                        track,
+                        repeats=3 if quick else 10,
+                        warmup=1,
+                        particles=fakes.FakeFramework.particles,
+                        lazy_beams=lazy_beams,
+                        fast_statistics=fast_statistics,
+                    )
+                    # The vectorised statistics against the fake beam's own per-attribute ones
+                    interface.set_values({"L01-QUAD01:k1l": 0.5})
+                    outputs = interface.track(observables)
+                if reference is None:
+                    reference = outputs
+                else:
+                    result["max_relative_difference"] = max(
+                        abs(outputs[name] / reference[name] - 1) for name in observables
+                    )
+                results.append(result)
+    return results
+
+
+# Run in a fresh interpreter per sample, without the fakes, so the real cost of
+# loading a plugin is seen along with which heavy modules it pulls in
+_import_script = """
+import os, sys, json, time, importlib
+root, catap_dir, module = sys.argv[1:4]
+sys.path[:0] = [root, catap_dir]
+start = time.perf_counter()
+importlib.import_module(module)
+elapsed = time.perf_counter() - start
+heavy = ("SimulationFramework", "CATAP", "epics", "h5py", "scipy.optimize")
+print(json.dumps({
+    "elapsed": elapsed,
+    "heavy": [name for name in heavy if name in sys.modules],
+    "ca_configured": "EPICS_CA_ADDR_LIST" in os.environ,
+}))
+"""
+
+import_targets = ("interfaces.CATAP", "interfaces.SimFrame", "environments.CATAPExample", "environments.SFExample")
+
+
+def bench_imports(quick: bool):
+    env = {key: value for key, value in os.environ.items() if not key.startswith("EPICS_CA_")}
+    results = []
+    for module in import_targets:
+        times = []
+        for _ in range(3 if quick else 10):
+            run = subprocess.run(
+                [sys.executable, "-c", _import_script, root, catap_dir, module],
+                capture_output=True,
+                text=True,
+                env=env,
+            )
+            if run.returncode != 0:
+                error = run.stderr.strip().splitlines()[-1] if run.stderr.strip() else "failed"
+                results.append(skipped("import", error, module=module))
+                break
+            sample = json.loads(run.stdout)
+            times.append(sample["elapsed"])
+        else:
+            results.append(
+                summarise(
+                    "import",
+                    times,
+                    module=module,
+                    heavy_modules=sample["heavy"],
+                    ca_configured=sample["ca_configured"],
+                )
+            )
+    return results
+
+
+benchmarks = {
+    "imports": bench_imports,
+    "otsu": bench_otsu,
+    "fit": bench_fit,
+    "get_data_array": bench_get_data_array,
+    "set_values": bench_set_values,
+    "track": bench_track,
+}
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _key(result: dict):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    """Print the median latency of each benchmark relative to ``baseline``."""
+    previous = {_key(result): result for result in baseline if "skipped" not in result}
+    for result in results:
+        old = previous.get(_key(result))
+        if old is None or "skipped" in result:
+            continue
+        ratio = result["p50_s"] / old["p50_s"]
+        print(
+            f"{result['name']:<24} {json.dumps(result['params'], sort_keys=True):<70} "
+            f"{old['p50_s'] * 1e3:9.2f} ms -> {result['p50_s'] * 1e3:9.2f} ms  x{ratio:.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline plugin benchmarks.")
+    parser.add_argument("-o", "--output", default=None, help="JSON results file (default: stdout)")
+    parser.add_argument("--only", default=None, help=f"Comma-separated subset of {', '.join(benchmarks)}")
+    parser.add_argument("--quick", action="store_true", help="Fewer repeats and cases")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(benchmarks)
+    results = []
+    for name in names:
+        print(f"Running {name}", file=sys.stderr)
+        results.extend(benchmarks[name](args.quick))
+    report = {"metadata": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
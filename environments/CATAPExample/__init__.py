@@ -1,15 +1,16 @@
-from copy import deepcopy
+from pydantic import Field
 from badger import environment
 from badger.errors import (
     BadgerNoInterfaceError,
 )
-from badger.formula import interpret_expression
-from SimulationFramework.Modules.optimisation.constraints import constraintsClass
+from environments.evaluation_store import EvaluationStoreMixin
+from environments.formulas import ConstraintsMixin
 from interfaces.CATAP import Interface
 
 
-class Environment(environment.Environment):
+class Environment(ConstraintsMixin, EvaluationStoreMixin, environment.Environment):
     name = "CATAPExample"
+    store_dir: str | None = Field(default=None)
 
     variables = {
         # "magnet:CLA-S02-MAG-QUAD-01:seti": [-10., 10.],
@@ -70,25 +71,12 @@ class Environment(environment.Environment):
     }
 
     def model_post_init(self, context):
-        self._cons = constraintsClass()
+        self.compile_constraints()
+        self.open_store()
+        if self.interface:
+            self.interface.prewarm(self._machine_areas)
         return super().model_post_init(context)
 
-    def process_value(self, value, observables: dict):
-        if isinstance(value, (list, tuple)):
-            return [self.process_value(v, observables) for v in value]
-        else:
-            if isinstance(value, str):
-                return interpret_expression(value, observables)
-        return value
-
-    def get_constraintsList(self, observables: dict):
-        con_list = deepcopy(self._constraintsList)
-        for cons in self._constraintsList:
-            for key in ["value", "limit"]:
-                con_list[cons][key] = self.process_value(con_list[cons][key], observables)
-
-        return self._cons.constraints(con_list)
-
     def get_observables(self, observable_names: list[str]) -> dict:
         if not self.interface:
             raise BadgerNoInterfaceError
@@ -96,4 +84,5 @@ class Environment(environment.Environment):
         observables = self.interface.get_observables(observable_names)
         if "constraintsList" in observable_names and self._constraintsList:
             observables["constraintsList"] = self.get_constraintsList(observables)
+        self.finish_evaluation(observables)
         return observables
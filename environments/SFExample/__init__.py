@@ -3,18 +3,20 @@
 #        self._framework.set_directory(directory)
 
 import os
-from copy import deepcopy
+import math
+import time
+import numpy as np
 from pydantic import Field
 from badger import environment
 from badger.errors import (
     BadgerNoInterfaceError,
 )
-from badger.formula import extract_variable_keys, interpret_expression
+from environments.evaluation_store import EvaluationStoreMixin
+from environments.formulas import ConstraintsMixin, Formula, formula_names
 from interfaces.SimFrame import SimFrameInterface
-from SimulationFramework.Modules.optimisation.constraints import constraintsClass
 
 
-class Environment(environment.Environment):
+class Environment(ConstraintsMixin, EvaluationStoreMixin, environment.Environment):
     base_dir: str | os.PathLike = os.path.abspath(r"C:\Users\jkj62.CLRC\Documents\GitHub\SimFrame_Examples\badger/")
     settings_file: str = Field(default="./basefiles/FEBE_2_Bunches.def")
     start_lattice: str | None = Field(default="FEBE")
@@ -23,6 +25,16 @@ class Environment(environment.Environment):
         default=os.path.abspath(r"../basefiles/")
     )
     sampling: int = Field(default=2)
+    cache_dir: str | None = Field(default=None)
+    workers: int = Field(default=1)
+    checkpoints: int = Field(default=0)
+    fidelity_sampling: list[int] = Field(default=[])
+    screen_fraction: float = Field(default=0.0)
+    scratch_dir: str | None = Field(default=None)
+    archive_file: str | None = Field(default=None)
+    supervised: bool = Field(default=False)
+    timeout: float | None = Field(default=None)
+    store_dir: str | None = Field(default=None)
 
     name = "SFExample"
     variables = {
@@ -30,6 +42,8 @@ class Environment(environment.Environment):
         "bunch_compressor:angle": [0.08, 0.15],
         "CLA-L02-LIN-CAV-01:phase": [0, 45],
         "CLA-L03-LIN-CAV-01:phase": [0, 45],
+        # Picks a level of fidelity_sampling, full fidelity at 1; no effect without it
+        "fidelity": [0.0, 1.0],
     }
     observables = [
         "CLA-FEC1-SIM-FOCUS-01:sigma_t",
@@ -37,6 +51,7 @@ class Environment(environment.Environment):
         "CLA-FEC1-SIM-FOCUS-01:eny",
         "CLA-FEC1-SIM-FOCUS-01:sigma_cp",
         "CLA-FEC1-SIM-FOCUS-01:mean_cp",
+        "fidelity",
         "constraintsList",
     ]
 
@@ -86,12 +101,13 @@ class Environment(environment.Environment):
         "CLA-L03-LIN-CAV-01:phase": 15.67,
         "CLA-L4H-LIN-CAV-01:phase": -186.7,
         "bunch_compressor:angle": 0.1229,
+        "fidelity": 1.0,
     }
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.compile_constraints()
         # Initialize the interface if not already set
-        self._cons = constraintsClass()
         self.interface = SimFrameInterface(
             base_dir=r"C:\Users\jkj62.CLRC\Documents\GitHub\SimFrame_Examples\badger/",
             settings_file=self.settings_file,
@@ -100,31 +116,93 @@ class Environment(environment.Environment):
             prefix=self.prefix,
             params=self.observables,
             sampling=self.sampling,
+            cache_dir=self.cache_dir,
+            workers=self.workers,
+            checkpoints=self.checkpoints,
+            fidelity_sampling=self.fidelity_sampling,
+            scratch_dir=self.scratch_dir,
+            archive_file=self.archive_file,
+            supervised=self.supervised,
+            timeout=self.timeout,
         )
         self.interface.set_values(self._set_variables)
+        self._reference_formulas = [
+            Formula(expression)
+            for expression in self._generator_params.get("reference_point", {})
+        ]
+        self._referenced_observables = self.referenced_observables()
+        self.open_store(self._set_variables)
 
-    def process_value(self, value, observables: dict):
-        if isinstance(value, (list, tuple)):
-            return [self.process_value(v, observables) for v in value]
-        else:
-            if isinstance(value, str):
-                return interpret_expression(value, observables)
-        return value
-
-    def get_constraintsList(self, observables: dict):
-        con_list = deepcopy(self._constraintsList)
-        for cons in self._constraintsList:
-            # print('get_constraints', cons, con_list[cons]["value"], self.process_value(con_list[cons]["value"], observables))
-            con_list[cons]["value"] = self.process_value(con_list[cons]["value"], observables)
-        # print("Constraints:", self._cons.constraintsList(con_list))
-        return self._cons.constraints(con_list)
+    def referenced_observables(self) -> list[str]:
+        """Observables used by the constraints and reference point formulas."""
+        names = formula_names(self._reference_formulas)
+        return names + [name for name in self._constraints.names if name not in names]
+
+    def cancel(self):
+        """Abort any tracking still running for this environment."""
+        if self.interface:
+            self.interface.cancel()
 
     @environment.process_formulas
     def get_observables(self, observable_names: list[str]) -> dict:
         if not self.interface:
             raise BadgerNoInterfaceError
 
-        observables = self.interface.get_observables(observable_names)
+        observables = self.interface.get_observables(
+            observable_names + [name for name in self._referenced_observables if name not in observable_names]
+        )
         if "constraintsList" in observable_names and self._constraintsList:
             observables["constraintsList"] = self.get_constraintsList(observables)
+        self.finish_evaluation(observables)
         return observables
+
+    def get_observables_batch(self, variable_inputs_list: list[dict], observable_names: list[str]) -> list[dict]:
+        if not self.interface:
+            raise BadgerNoInterfaceError
+
+        names = observable_names + [name for name in self._referenced_observables if name not in observable_names]
+        start = time.monotonic()
+        if self.fidelity_sampling and self.screen_fraction > 0:
+            results = self.screen_batch(variable_inputs_list, names)
+        else:
+            results = self.interface.evaluate_batch(variable_inputs_list, names)
+        if "constraintsList" in observable_names and self._constraintsList:
+            for observables, penalty in zip(results, self.get_constraintsList_batch(results)):
+                observables["constraintsList"] = penalty
+        # Batched points share the batch wall time equally
+        elapsed = (time.monotonic() - start) / max(len(results), 1)
+        for inputs, observables in zip(variable_inputs_list, results):
+            self.record_evaluation(inputs, observables, elapsed)
+        return results
+
+    def screen_batch(self, variable_inputs_list: list[dict], observable_names: list[str]) -> list[dict]:
+        """Track every point at the lowest fidelity, then re-track the best ``screen_fraction`` at full fidelity.
+
+        Candidates are ranked on the constraint penalty, then on the sum of the
+        reference point formulas, each scaled by its reference value, so that
+        among feasible points the best objectives are promoted. Each result
+        carries a ``fidelity`` observable.
+        """
+        names = observable_names + [name for name in ["fidelity"] if name not in observable_names]
+        results = self.interface.evaluate_batch(
+            [inputs | {"fidelity": 0.0} for inputs in variable_inputs_list], names
+        )
+
+        penalties = [
+            value if math.isfinite(value) else math.inf
+            for value in map(float, self.get_constraintsList_batch(results))
+        ]
+        scores = np.zeros(len(results))
+        for formula, reference in zip(
+            self._reference_formulas, self._generator_params.get("reference_point", {}).values()
+        ):
+            scores += formula.batch(results) / (abs(reference) or 1.0)
+        scores[~np.isfinite(scores)] = np.inf
+        count = math.ceil(self.screen_fraction * len(results))
+        promoted = sorted(range(len(results)), key=lambda index: (penalties[index], scores[index]))[:count]
+        full = self.interface.evaluate_batch(
+            [variable_inputs_list[index] | {"fidelity": 1.0} for index in promoted], names
+        )
+        for index, observables in zip(promoted, full):
+            results[index] = observables
+        return results
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import math
+import hashlib
+import numpy as np
+
+_row_columns = ("_time", "_fidelity", "_elapsed")
+
+
+class EvaluationStore:
+    """Append-only columnar record of evaluations for one environment and variable set.
+
+    Each store is a directory holding the inputs as one row-major float64 file
+    and every numeric observable as its own float64 column, so all of them can be
+    memory-mapped. Rows are committed by the inputs write, which comes last;
+    columns left longer by an interrupted append are trimmed on the next one and
+    observables missing from a row read as NaN. A store has a single writer.
+    """
+
+    def __init__(self, directory: str | os.PathLike, environment: str, variables: list[str]):
+        self.environment = environment
+        self.variables = sorted(variables)
+        key = hashlib.sha256(
+            json.dumps([environment, self.variables]).encode("utf-8")
+        ).hexdigest()[:16]
+        self.path = os.path.join(directory, f"{environment}-{key}")
+        os.makedirs(os.path.join(self.path, "columns"), exist_ok=True)
+        self._meta_path = os.path.join(self.path, "meta.json")
+        self._inputs_path = os.path.join(self.path, "inputs.f64")
+        if os.path.isfile(self._meta_path):
+            with open(self._meta_path) as f:
+                self._columns = json.load(f)["columns"]
+        else:
+            self._columns = {}
+            self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            "environment": self.environment,
+            "variables": self.variables,
+            "columns": self._columns,
+        }
+        with open(self._meta_path + ".tmp", "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(self._meta_path + ".tmp", self._meta_path)
+
+    def _column_path(self, name: str, create: bool = False) -> str | None:
+        # Observable names hold ':' and other characters unsafe in file names
+        if name not in self._columns:
+            if not create:
+                return None
+            self._columns[name] = f"c{len(self._columns):05d}.f64"
+            self._write_meta()
+        return os.path.join(self.path, "columns", self._columns[name])
+
+    def __len__(self) -> int:
+        if not os.path.isfile(self._inputs_path) or not self.variables:
+            return 0
+        return os.path.getsize(self._inputs_path) // (8 * len(self.variables))
+
+    @property
+    def columns(self) -> list[str]:
+        """Recorded observable names."""
+        return [name for name in self._columns if name not in _row_columns]
+
+    def append(
+        self,
+        inputs: dict,
+        observables: dict,
+        fidelity: float | None = None,
+        elapsed: float | None = None,
+    ):
+        n = len(self)
+        values = {}
+        for name, value in observables.items():
+            try:
+                values[name] = float(value)
+            except (TypeError, ValueError):
+                continue
+        values["_time"] = time.time()
+        values["_fidelity"] = math.nan if fidelity is None else float(fidelity)
+        values["_elapsed"] = math.nan if elapsed is None else float(elapsed)
+        for name, value in values.items():
+            path = self._column_path(name, create=True)
+            length = os.path.getsize(path) // 8 if os.path.isfile(path) else 0
+            with open(path, "r+b" if length else "wb") as f:
+                if length > n:
+                    f.truncate(8 * n)
+                f.seek(0, os.SEEK_END)
+                if length < n:
+                    f.write(np.full(n - length, np.nan).tobytes())
+                f.write(np.float64(value).tobytes())
+        row = np.array([float(inputs.get(name, math.nan)) for name in self.variables])
+        with open(self._inputs_path, "ab") as f:
+            f.truncate(8 * len(self.variables) * n)
+            f.write(row.tobytes())
+
+    def inputs(self) -> np.ndarray:
+        """(evaluations, variables) array of inputs, columns ordered as ``variables``."""
+        n = len(self)
+        if n == 0:
+            return np.empty((0, len(self.variables)))
+        return np.memmap(self._inputs_path, dtype=np.float64, mode="r", shape=(n, len(self.variables)))
+
+    def column(self, name: str) -> np.ndarray:
+        n = len(self)
+        path = self._column_path(name)
+        length = min(os.path.getsize(path) // 8, n) if path and os.path.isfile(path) else 0
+        if length == 0:
+            return np.full(n, np.nan)
+        data = np.memmap(path, dtype=np.float64, mode="r", shape=(length,))
+        if length < n:
+            return np.concatenate((data, np.full(n - length, np.nan)))
+        return data
+
+    def record(self, index: int, observable_names: list[str] | None = None) -> tuple[dict, dict]:
+        """Inputs and observables of one evaluation."""
+        inputs = dict(zip(self.variables, map(float, self.inputs()[index])))
+        observables = {}
+        for name in self.columns if observable_names is None else observable_names:
+            value = float(self.column(name)[index])
+            if not math.isnan(value):
+                observables[name] = value
+        return inputs, observables
+
+    def records(self, observable_names: list[str] | None = None):
+        """Replay every evaluation in the order it was recorded."""
+        for index in range(len(self)):
+            yield self.record(index, observable_names)
+
+    def _within(self, bounds: dict | None) -> np.ndarray:
+        inputs = self.inputs()
+        mask = np.all(np.isfinite(inputs), axis=1)
+        for column, name in enumerate(self.variables):
+            if bounds and name in bounds:
+                lower, upper = bounds[name]
+                mask &= (inputs[:, column] >= lower) & (inputs[:, column] <= upper)
+        return mask
+
+    def nearest(self, inputs: dict, k: int = 1, bounds: dict | None = None) -> list[tuple[float, int]]:
+        """The ``k`` closest evaluations as (distance, index), scaled by the variable ranges in ``bounds``."""
+        data = self.inputs()
+        if len(data) == 0:
+            return []
+        scale = np.array(
+            [
+                (bounds[name][1] - bounds[name][0]) if bounds and name in bounds else 1.0
+                for name in self.variables
+            ]
+        )
+        scale[scale == 0] = 1.0
+        point = np.array([float(inputs.get(name, math.nan)) for name in self.variables])
+        known = np.isfinite(point)
+        distance = np.sqrt(
+            np.sum(((data[:, known] - point[known]) / scale[known]) ** 2, axis=1)
+        )
+        distance[~np.all(np.isfinite(data[:, known]), axis=1)] = np.inf
+        k = min(k, len(distance))
+        order = np.argpartition(distance, k - 1)[:k]
+        order = order[np.argsort(distance[order])]
+        return [(float(distance[index]), int(index)) for index in order if np.isfinite(distance[index])]
+
+    def seed(
+        self,
+        n: int,
+        bounds: dict | None = None,
+        objective: str | None = None,
+        maximize: bool = False,
+        min_fidelity: float | None = None,
+    ) -> list[dict]:
+        """Inputs of up to ``n`` past evaluations inside ``bounds`` to start a new run from.
+
+        Ranked on ``objective`` when given (missing values last), otherwise most recent first.
+        """
+        mask = self._within(bounds)
+        if min_fidelity is not None:
+            fidelity = self.column("_fidelity")
+            # Runs without a fidelity setting were at full fidelity
+            mask &= np.isnan(fidelity) | (fidelity >= min_fidelity)
+        candidates = np.flatnonzero(mask)
+        if objective is not None:
+            values = self.column(objective)[candidates]
+            values = np.where(np.isfinite(values), -values if maximize else values, np.inf)
+            candidates = candidates[np.argsort(values, kind="stable")]
+        else:
+            candidates = candidates[::-1]
+        inputs = self.inputs()
+        return [dict(zip(self.variables, map(float, inputs[index]))) for index in candidates[:n]]
+
+
+class EvaluationStoreMixin:
+    """Environment methods that record every evaluation to an :class:`EvaluationStore`.
+
+    Mixed in ahead of ``badger.environment.Environment`` by environments with a
+    ``store_dir`` field. :meth:`open_store` is called once the environment is set
+    up; ``set_variables`` then marks the start of an evaluation, and
+    :meth:`finish_evaluation`, called at the end of ``get_observables``, records it.
+
+    Seeding is only available through this API: Badger's initial point actions
+    cannot ask an environment for points, so :meth:`initial_points` returns them
+    in the form ``Routine.initial_points`` takes, for routines built in scripts.
+    """
+
+    def open_store(self, initial_inputs: dict | None = None):
+        # Fidelity is recorded per evaluation rather than as an input
+        names = [name for name in self.variables if name != "fidelity"]
+        self._store = (
+            EvaluationStore(self.store_dir, self.name, names)
+            if self.store_dir is not None
+            else None
+        )
+        self._variable_inputs = {
+            name: value for name, value in (initial_inputs or {}).items() if name in self.variables
+        }
+        self._evaluation_start = None
+
+    def set_variables(self, variable_inputs: dict[str, float]):
+        self._variable_inputs = self._variable_inputs | variable_inputs
+        self._evaluation_start = time.monotonic()
+        return super().set_variables(variable_inputs)
+
+    def finish_evaluation(self, observables: dict):
+        """Record the point last set with the observables read for it."""
+        if self._evaluation_start is not None:
+            self.record_evaluation(
+                self._variable_inputs, observables, time.monotonic() - self._evaluation_start
+            )
+
+    def record_evaluation(self, inputs: dict, observables: dict, elapsed: float | None = None):
+        if self._store is not None:
+            self._store.append(
+                inputs, observables, fidelity=observables.get("fidelity", inputs.get("fidelity")), elapsed=elapsed
+            )
+
+    def seed_points(self, n: int = 10, objective: str | None = None, maximize: bool = False) -> list[dict]:
+        """Inputs of past evaluations within the current variable ranges, to start a new run from."""
+        if self._store is None:
+            return []
+        # Screening results are only seeded from points evaluated at full fidelity
+        return self._store.seed(
+            n, bounds=self.variables, objective=objective, maximize=maximize, min_fidelity=1.0
+        )
+
+    def initial_points(
+        self,
+        n: int = 10,
+        objective: str | None = None,
+        maximize: bool = False,
+        variable_names: list[str] | None = None,
+    ) -> dict[str, list[float]]:
+        """:meth:`seed_points` as a column per variable, for ``Routine(initial_points=...)``."""
+        points = self.seed_points(n, objective, maximize)
+        names = variable_names if variable_names is not None else (self._store.variables if self._store else [])
+        # Seeds are full-fidelity points
+        return {name: [point.get(name, 1.0 if name == "fidelity" else math.nan) for point in points] for name in names}
+
+    def nearest_evaluations(self, variable_inputs: dict, k: int = 5) -> list[tuple[dict, dict]]:
+        """Inputs and observables of the ``k`` recorded evaluations closest to ``variable_inputs``."""
+        if self._store is None:
+            return []
+        return [
+            self._store.record(index)
+            for _, index in self._store.nearest(variable_inputs, k, bounds=self.variables)
+        ]
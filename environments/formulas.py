@@ -0,0 +1,196 @@
+import re
+import ast
+import math
+import builtins
+import numpy as np
+from badger.formula import extract_variable_keys, interpret_expression
+
+# Names available to formulas, as built by badger.formula.interpret_expression
+_numpy_names = [name for name in dir(np) if not name.startswith("_")]
+_builtin_names = ("len", "sum", "min", "max", "abs", "round")
+_namespace = {name: getattr(np, name) for name in _numpy_names}
+_namespace["percentile"] = np.percentile
+_namespace.update({name: getattr(builtins, name) for name in _builtin_names})
+_known_names = set(_namespace) | {"rms"}
+# Names that act element by element, so a formula using only these works on columns
+_elementwise = {
+    name for name, value in _namespace.items() if isinstance(value, np.ufunc) or not callable(value)
+} | {"abs"}
+_globals = {"__builtins__": {}}
+
+
+class _Scope(dict):
+    # Formula arguments, falling back to the shared namespace without copying it
+    def __missing__(self, name):
+        return _namespace[name]
+
+
+class Formula:
+    """A backtick formula parsed once; calling it binds observable values by name.
+
+    The expression is rewritten and checked as ``interpret_expression`` does.
+    Anything that does not compile or fails to evaluate is handed to
+    ``interpret_expression``, so values and errors match Badger's.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.names = list(dict.fromkeys(extract_variable_keys(expression)))
+        self._arguments = {name: f"_v{index}" for index, name in enumerate(self.names)}
+        source = expression
+        for name in sorted(self.names, key=len, reverse=True):
+            source = source.replace(f"`{name}`", self._arguments[name])
+        source = re.sub(r"percentile(\d+)\(([^)]+)\)", r"percentile(\2, \1)", source)
+        source = re.sub(r"\brms\(([^)]+)\)", r"sqrt(mean((\1)**2))", source)
+        self._code = None
+        self._vectorised = False
+        try:
+            used = {node.id for node in ast.walk(ast.parse(source, mode="eval")) if isinstance(node, ast.Name)}
+        except SyntaxError:
+            return
+        functions = used - set(self._arguments.values())
+        if functions <= _known_names:
+            self._code = compile(source, "<formula>", "eval")
+            self._vectorised = functions <= _elementwise
+
+    def __call__(self, observables: dict):
+        if self._code is not None:
+            try:
+                return eval(
+                    self._code,
+                    _globals,
+                    _Scope({self._arguments[name]: observables[name] for name in self.names}),
+                )
+            except Exception:
+                pass
+        return interpret_expression(self.expression, observables)
+
+    def batch(self, observables_list: list[dict]) -> np.ndarray:
+        """Evaluate over many observable dicts, with one array operation where the formula is element-wise."""
+        if self._vectorised:
+            try:
+                columns = {
+                    self._arguments[name]: np.array(
+                        [observables.get(name, math.nan) for observables in observables_list],
+                        dtype=float,
+                    )
+                    for name in self.names
+                }
+                values = eval(self._code, _globals, _Scope(columns))
+                return np.broadcast_to(np.asarray(values, dtype=float), (len(observables_list),))
+            except (TypeError, ValueError):
+                pass
+        return np.array([self(observables) for observables in observables_list], dtype=float)
+
+    def __repr__(self):
+        return f"Formula({self.expression!r})"
+
+
+def compile_value(value):
+    """Replace every formula string in ``value`` (possibly a list) with a :class:`Formula`."""
+    if isinstance(value, (list, tuple)):
+        return [compile_value(v) for v in value]
+    if isinstance(value, str):
+        return Formula(value)
+    return value
+
+
+def evaluate_value(value, observables: dict):
+    if isinstance(value, list):
+        return [evaluate_value(v, observables) for v in value]
+    if isinstance(value, Formula):
+        return value(observables)
+    return value
+
+
+def _batch_value(value, observables_list: list[dict]):
+    # Per-point values, with every formula evaluated once for the whole batch
+    if isinstance(value, list):
+        columns = [_batch_value(v, observables_list) for v in value]
+        return [[column[index] for column in columns] for index in range(len(observables_list))]
+    if isinstance(value, Formula):
+        return [float(v) for v in value.batch(observables_list)]
+    return [value] * len(observables_list)
+
+
+def formula_names(formulas) -> list[str]:
+    names = []
+    for formula in formulas:
+        if isinstance(formula, list):
+            candidates = formula_names(formula)
+        elif isinstance(formula, Formula):
+            candidates = formula.names
+        else:
+            continue
+        names.extend(name for name in candidates if name not in names)
+    return names
+
+
+class CompiledConstraints:
+    """Constraint definitions whose ``value`` and ``limit`` formulas are parsed once.
+
+    :meth:`bind` returns the definitions with observables substituted, in the form
+    ``constraintsClass.constraints`` expects, as fresh dicts rather than deep copies.
+    """
+
+    def __init__(self, constraints: dict, keys=("value", "limit")):
+        self.keys = keys
+        self._constraints = {
+            name: {
+                key: compile_value(value) if key in keys else value
+                for key, value in cons.items()
+            }
+            for name, cons in constraints.items()
+        }
+
+    @property
+    def names(self) -> list[str]:
+        """Observables referenced by any constraint formula."""
+        return formula_names(
+            [cons[key] for cons in self._constraints.values() for key in self.keys if key in cons]
+        )
+
+    def bind(self, observables: dict) -> dict:
+        return {
+            name: {
+                key: evaluate_value(value, observables) if key in self.keys else value
+                for key, value in cons.items()
+            }
+            for name, cons in self._constraints.items()
+        }
+
+    def bind_batch(self, observables_list: list[dict]) -> list[dict]:
+        """:meth:`bind` for many points, evaluating each formula once over the batch."""
+        bound = [{name: {} for name in self._constraints} for _ in observables_list]
+        for name, cons in self._constraints.items():
+            for key, value in cons.items():
+                values = (
+                    _batch_value(value, observables_list)
+                    if key in self.keys
+                    else [value] * len(observables_list)
+                )
+                for point, v in zip(bound, values):
+                    point[name][key] = v
+        return bound
+
+
+class ConstraintsMixin:
+    """Environment methods turning ``_constraintsList`` into the ``constraintsList`` penalty.
+
+    Mixed in ahead of ``badger.environment.Environment``; :meth:`compile_constraints`
+    is called when the environment is created.
+    """
+
+    def compile_constraints(self):
+        # SimulationFramework is imported when the environment is created, not when it is listed
+        from SimulationFramework.Modules.optimisation.constraints import constraintsClass
+
+        self._cons = constraintsClass()
+        self._constraints = CompiledConstraints(self._constraintsList)
+
+    def get_constraintsList(self, observables: dict):
+        return self._cons.constraints(self._constraints.bind(observables))
+
+    def get_constraintsList_batch(self, observables_list: list[dict]) -> list:
+        """Constraint penalties for many points, evaluating each formula once over the batch."""
+        return [self._cons.constraints(con_list) for con_list in self._constraints.bind_batch(observables_list)]
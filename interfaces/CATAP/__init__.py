@@ -1,92 +1,526 @@
 import os
 import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 from badger import interface
-from CATAP.diagnostics.camera import CameraFactory
-from CATAP.diagnostics.charge import ChargeFactory
-from CATAP.laser.pi_laser import PILaserFactory
-from CATAP.magnet import MagnetFactory
-from image_saving import get_beam_image_with_background
+from pydantic import Field
+from file_cache import configure_file_cache
+from pv_cache import MonitorCache, read_pvs
+from shot_statistics import robust_statistic
+from interfaces.timing import timer
 
-os.environ["EPICS_CA_ADDR_LIST"] = "192.168.83.255 192.168.119.255"
-os.environ["EPICS_CA_SERVER_PORT"] = ""
-os.environ["EPICS_CA_AUT_ADDR_LIST"] = "NO"
+logger = logging.getLogger(__name__)
+
+# Channel Access settings for the CLARA network, applied when the interface is first used
+channel_access = {
+    "EPICS_CA_ADDR_LIST": "192.168.83.255 192.168.119.255",
+    "EPICS_CA_SERVER_PORT": "",
+    "EPICS_CA_AUT_ADDR_LIST": "NO",
+}
+_channel_access_configured = False
+
+
+def configure_channel_access():
+    """Apply ``channel_access`` to the environment, once, before any CA context exists."""
+    global _channel_access_configured
+    if not _channel_access_configured:
+        os.environ.update(channel_access)
+        _channel_access_configured = True
 
 factories = {}
 machine_areas = {}
+_pending_factories = {}
+_factory_lock = threading.Lock()
+
+
+def _create_factory(factory_name: str):
+    configure_channel_access()
+    if factory_name not in machine_areas:
+        machine_areas[factory_name] = None
+    logger.info('Initialising %s factory with areas: %s', factory_name, machine_areas[factory_name])
+    # CATAP is imported here, so loading the plugin does not pull it in
+    if factory_name == "magnet":
+        from CATAP.magnet import MagnetFactory
+
+        return MagnetFactory(is_virtual=False, areas=machine_areas[factory_name])
+    elif factory_name == "charge":
+        from CATAP.diagnostics.charge import ChargeFactory
+
+        return ChargeFactory(is_virtual=False, areas=machine_areas[factory_name])
+    elif factory_name == "camera":
+        from CATAP.diagnostics.camera import CameraFactory
+
+        return CameraFactory(is_virtual=False, areas=machine_areas[factory_name])
+    elif factory_name == "pilaser":
+        from CATAP.laser.pi_laser import PILaserFactory
+
+        return PILaserFactory(is_virtual=False, areas=machine_areas[factory_name])
+    raise KeyError(factory_name)
 
 
 def get_factory(factory_name: str):
-    if factory_name not in factories:
-        if factory_name not in machine_areas:
-            machine_areas[factory_name] = None
-        print(f'Initialising {factory_name} factory with areas: {machine_areas[factory_name]}!')
-        if factory_name == "magnet":
-            _magnetFactory = MagnetFactory(is_virtual=False, areas=machine_areas[factory_name])
-            factories[factory_name] = _magnetFactory
-        elif factory_name == "charge":
-            _chargeFactory = ChargeFactory(is_virtual=False, areas=machine_areas[factory_name])
-            factories[factory_name] = _chargeFactory
-        elif factory_name == "camera":
-            _cameraFactory = CameraFactory(is_virtual=False, areas=machine_areas[factory_name])
-            factories[factory_name] = _cameraFactory
-        elif factory_name == "pilaser":
-            _laserFactory = PILaserFactory(is_virtual=False, areas=machine_areas[factory_name])
-            factories[factory_name] = _laserFactory
-    return factories[factory_name]
+    # A factory is built by the first caller; anyone else asking meanwhile waits for it
+    with _factory_lock:
+        if factory_name in factories:
+            return factories[factory_name]
+        future = _pending_factories.get(factory_name)
+        owner = future is None
+        if owner:
+            future = _pending_factories[factory_name] = Future()
+    if owner:
+        try:
+            factory = _create_factory(factory_name)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            with _factory_lock:
+                factories[factory_name] = factory
+            future.set_result(factory)
+        finally:
+            with _factory_lock:
+                _pending_factories.pop(factory_name, None)
+    return future.result()
+
+
+def prewarm_factories(areas: dict[str, list[str] | None]):
+    """Restrict each factory to the given machine areas and build them in background threads."""
+    threads = []
+    for factory_name, factory_areas in areas.items():
+        with _factory_lock:
+            if factory_name in factories or factory_name in _pending_factories:
+                logger.info('%s factory already initialised, areas unchanged', factory_name)
+                continue
+            machine_areas[factory_name] = factory_areas
+        thread = threading.Thread(
+            target=get_factory, args=(factory_name,), daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
 
 
 class Interface(interface.Interface):
     name = "CATAP"
 
+    settle_tolerance: dict[str, float] = Field(
+        default={"magnet": 0.05},
+        description="Allowed |readback - setpoint| for each factory",
+    )
+    settle_timeout: dict[str, float] = Field(
+        default={"magnet": 5.0},
+        description="Longest wait for readbacks to settle for each factory",
+    )
+    settle_time: float = Field(
+        default=1.0, description="Fixed wait for channels without a readback"
+    )
+    readbacks: dict[str, dict[str, str]] = Field(
+        default={"magnet": {"seti": "readi"}},
+        description="Readback attribute for each setpoint method, per factory",
+    )
+    poll_interval: float = Field(
+        default=0.05, description="Interval between readback checks"
+    )
+    pv_names: dict[str, dict[str, str]] = Field(
+        default={
+            "magnet": {"seti": "{element}:SETI", "readi": "{element}:READI"},
+            "charge": {"q": "{element}:Q"},
+        },
+        description="PV template for each method, per factory, for bulk reads",
+    )
+    read_timeout: float = Field(default=1.0, description="Bulk read timeout")
+    use_monitors: bool = Field(
+        default=False, description="Serve reads from CA monitors where fresh"
+    )
+    monitor_max_age: float | None = Field(
+        default=2.0,
+        description="Oldest value accepted from a PV without a live monitor, e.g. while disconnected",
+    )
+    shots: dict[str, int] = Field(
+        default={},
+        description="Samples per reading, keyed by observable or factory name",
+    )
+    shot_statistic: dict[str, str] = Field(
+        default={},
+        description="mean, median or clipped, keyed by observable or factory name",
+    )
+    repetition_rate: float = Field(
+        default=10.0, description="Machine repetition rate in Hz"
+    )
+    clip_sigma: float = Field(
+        default=3.0, description="Rejection threshold for clipped statistics"
+    )
+    background_max_age: float | None = Field(
+        default=300.0, description="Seconds before a cached background is retaken"
+    )
+    background_max_uses: int | None = Field(
+        default=50, description="Evaluations before a cached background is retaken"
+    )
+    background_drift: float | None = Field(
+        default=None, description="Border level change that forces a new background"
+    )
+    background_frames: int = Field(
+        default=1, description="Background frames averaged on each refresh"
+    )
+    camera_frames: int = Field(
+        default=1, description="Frames fitted and averaged per camera observable"
+    )
+    pipeline_workers: int = Field(
+        default=4, description="Threads fitting streamed camera frames"
+    )
+    fit_cut: int = Field(default=1, description="Pixel sub-sampling before fitting")
+    fit_mode: str | None = Field(
+        default="roi",
+        description="Beam fit strategy: full, roi, projection or coarse_to_fine; None for the plain full-frame fit",
+    )
+    image_cache: str | None = Field(
+        default=None,
+        description="Local directory caching image files loaded for analysis; CATAP_IMAGE_CACHE if unset",
+    )
+    image_cache_bytes: int = Field(
+        default=2**32, description="Size limit of the image cache directory"
+    )
+    timing: bool = Field(
+        default=False,
+        description="Record per-phase wall times, readable as timing:<phase> observables",
+    )
+    timing_log: str | None = Field(
+        default=None, description="JSON-lines file receiving the phase times of each evaluation"
+    )
+
     # Private variables
     _states: dict = {}
+    _setpoints: dict = {}
+    _monitors: MonitorCache | None = None
+    _pipelines: dict = {}
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        configure_channel_access()
+        if self.image_cache is not None:
+            configure_file_cache(self.image_cache, self.image_cache_bytes)
+
+    def close(self):
+        """Stop the frame pipelines and put the cameras back as they were found, e.g. their scale factor."""
+        from image_saving import close_acquisitions
+
+        while self._pipelines:
+            _, pipeline = self._pipelines.popitem()
+            pipeline.close()
+        close_acquisitions()
+
+    def prewarm(self, areas: dict[str, list[str] | None]):
+        """Start connecting the factories an environment needs, limited to its areas."""
+        return prewarm_factories(areas)
+
+    def _write(self, channel, element, value):
+        factory, element_name, method = channel.split(":")
+        logger.info('CATAP setting %s from factory %s to %s via %s', element_name, factory, value, method)
+        setattr(element, method, value)
+        self._states[channel] = value
+        self._setpoints[channel] = value
 
     def set_values(self, channel_inputs):
-        for channel, value in channel_inputs.items():
+        changes = {
+            channel: value
+            for channel, value in channel_inputs.items()
+            if channel not in self._setpoints or self._setpoints[channel] != value
+        }
+        timer.start(self)
+        if not changes:
+            return
+        # Factories are created on first use, so resolve the hardware before writing in parallel
+        elements = {}
+        for channel in changes:
             factory, element_name, method = channel.split(":")
-            print(f'CATAP setting {element_name} from factory {factory} to {value} via {method}')
-            element = get_factory(factory).get_hardware(element_name)
-            setattr(element, method, value)
+            elements[channel] = get_factory(factory).get_hardware(element_name)
+        start = time.monotonic()
+        with timer.phase("write"), ThreadPoolExecutor(max_workers=len(changes)) as executor:
+            for future in [
+                executor.submit(self._write, channel, elements[channel], value)
+                for channel, value in changes.items()
+            ]:
+                future.result()
+        with timer.phase("settle"):
+            self.wait_for_settle(changes, start)
 
-            self._states[channel] = value
-        time.sleep(1)
+    def wait_for_settle(self, changes: dict, start: float):
+        """Poll readbacks until each written channel is within tolerance or times out."""
+        pending = {}
+        fixed_wait = False
+        for channel, value in changes.items():
+            factory, element_name, method = channel.split(":")
+            readback = self.readbacks.get(factory, {}).get(method)
+            if readback is None:
+                fixed_wait = True
+                continue
+            pending[f"{factory}:{element_name}:{readback}"] = (
+                channel,
+                value,
+                self.settle_tolerance.get(factory, 0.0),
+                start + self.settle_timeout.get(factory, self.settle_time),
+            )
+        while pending:
+            values, _ = self.read_channels(list(pending))
+            now = time.monotonic()
+            for readback, (channel, value, tolerance, deadline) in list(pending.items()):
+                try:
+                    settled = abs(values[readback] - value) <= tolerance
+                except Exception:
+                    settled = False
+                if settled:
+                    del pending[readback]
+                elif now > deadline:
+                    logger.warning('CATAP %s did not settle within %.1f s', channel, deadline - start)
+                    del pending[readback]
+            if pending:
+                time.sleep(self.poll_interval)
+        if fixed_wait:
+            time.sleep(max(0.0, start + self.settle_time - time.monotonic()))
 
-    def get_values(self, channel_names):
-        channel_outputs = {}
+    def pv_name(self, channel: str) -> str | None:
+        factory, element_name, method = channel.split(":")
+        template = self.pv_names.get(factory, {}).get(method)
+        return template.format(element=element_name) if template else None
 
-        for channel in channel_names:
+    def read_channels(self, channels: list[str]) -> tuple[dict, dict]:
+        """Read channels, batching those with known PVs into one request.
+
+        Returns the values that were read and the exception for each channel that failed.
+        """
+        values = {}
+        errors = {}
+        pvs = {}
+        for channel in channels:
+            try:
+                pvname = self.pv_name(channel)
+            except ValueError as e:
+                errors[channel] = e
+                continue
+            if pvname is not None:
+                pvs[channel] = pvname
+
+        if self.use_monitors and pvs:
+            if self._monitors is None:
+                self._monitors = MonitorCache(max_age=self.monitor_max_age)
+            self._monitors.monitor(pvs.values())
+            for channel, pvname in pvs.items():
+                value = self._monitors.get(pvname)
+                if value is not None:
+                    values[channel] = value
+
+        missing = [channel for channel in pvs if channel not in values]
+        if missing:
+            read = read_pvs([pvs[channel] for channel in missing], timeout=self.read_timeout)
+            if self._monitors is not None:
+                self._monitors.update(read)
+            for channel in missing:
+                if read[pvs[channel]] is not None:
+                    values[channel] = read[pvs[channel]]
+
+        # Anything without a PV, or whose PV could not be read, goes through CATAP
+        remaining = [ch for ch in channels if ch not in values and ch not in errors]
+        elements = {}
+        for channel in remaining:
             try:
                 factory, element_name, method = channel.split(":")
-                element = get_factory(factory).get_hardware(element_name)
-                print(f'CATAP getting {method} for {element_name} from factory {factory}')
-                value = getattr(element, method)
-                print(f'\tvalue = {value}')
-                self._states[channel] = value
-            except Exception:
-                self._states[channel] = value = 0
+                elements[channel] = (get_factory(factory).get_hardware(element_name), method)
+            except Exception as e:
+                errors[channel] = e
+        if elements:
+            with ThreadPoolExecutor(max_workers=len(elements)) as executor:
+                futures = {
+                    channel: executor.submit(getattr, element, method)
+                    for channel, (element, method) in elements.items()
+                }
+            for channel, future in futures.items():
+                try:
+                    values[channel] = future.result()
+                except Exception as e:
+                    errors[channel] = e
+        return values, errors
 
+    def get_values(self, channel_names):
+        channel_outputs = {}
+
+        logger.debug('CATAP getting %d channels', len(channel_names))
+        values, _ = self.read_channels(channel_names)
+        for channel in channel_names:
+            value = values.get(channel, 0)
+            self._states[channel] = value
             channel_outputs[channel] = value
 
         return channel_outputs
 
+    def _shot_setting(self, setting: dict, channel: str, default):
+        if channel in setting:
+            return setting[channel]
+        return setting.get(channel.split(":")[0], default)
+
+    def acquire(self, channels: list[str]) -> tuple[dict, dict, dict]:
+        """Sample each channel for its configured number of shots at the repetition rate.
+
+        Returns the robust value and the spread of each channel, plus the exception
+        for each channel that could not be read at all.
+        """
+        counts = {channel: self._shot_setting(self.shots, channel, 1) for channel in channels}
+        shots = max(counts.values(), default=1)
+        if shots <= 1:
+            values, errors = self.read_channels(channels)
+            return values, {channel: float("nan") for channel in values}, errors
+
+        index = {channel: column for column, channel in enumerate(channels)}
+        buffer = np.full((shots, len(channels)), np.nan)
+        first = {}
+        failures = {}
+        period = 1.0 / self.repetition_rate
+        for shot in range(shots):
+            start = time.monotonic()
+            active = [channel for channel in channels if counts[channel] > shot]
+            values, errors = self.read_channels(active)
+            for channel, error in errors.items():
+                failures.setdefault(channel, []).append(error)
+            if shot == 0:
+                first = values
+            for channel in active:
+                try:
+                    buffer[shot, index[channel]] = float(values[channel])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            if shot < shots - 1:
+                time.sleep(max(0.0, period - (time.monotonic() - start)))
+
+        values = {}
+        spreads = {}
+        groups = {}
+        for channel in channels:
+            if counts[channel] <= 1:
+                if channel in first:
+                    values[channel] = first[channel]
+                    spreads[channel] = float("nan")
+                continue
+            statistic = self._shot_setting(self.shot_statistic, channel, "mean")
+            groups.setdefault(statistic, []).append(channel)
+        for statistic, group in groups.items():
+            columns = [index[channel] for channel in group]
+            centre, spread = robust_statistic(
+                buffer[:, columns], statistic=statistic, sigma=self.clip_sigma
+            )
+            for channel, value, width in zip(group, centre, spread):
+                if np.isfinite(value):
+                    values[channel] = float(value)
+                    spreads[channel] = float(width)
+        errors = {}
+        for channel in channels:
+            if channel in values:
+                continue
+            if channel in failures:
+                error = ValueError(
+                    f"{len(failures[channel])} of {counts[channel]} shots of {channel} "
+                    f"could not be read, last error: {failures[channel][-1]!r}"
+                )
+                error.__cause__ = failures[channel][-1]
+            else:
+                error = ValueError(f"No valid samples for {channel}")
+            errors[channel] = error
+        return values, spreads, errors
+
     def get_observables(self, observable_names: list[str]) -> dict:
+        timer.start(self, observable_names)
         outputs = {}
 
+        # "factory:element:method:spread" reports the shot-to-shot spread of a reading
+        channels = []
         for observable in observable_names:
-            if ':' in observable:
-                factory, element_name, method = observable.split(":")
-                print(f'CATAP observing {method} for {element_name} from factory {factory}')
+            if ':' in observable and observable.split(":")[0] not in ["camera", "screen", "timing"]:
+                channel = ":".join(observable.split(":")[:3])
+                if channel not in channels:
+                    channels.append(channel)
+        with timer.phase("acquire"):
+            values, spreads, errors = self.acquire(channels)
+
+        fits = {}
+        for observable in observable_names:
+            if observable.startswith("timing:"):
+                continue
+            elif ':' in observable:
+                factory, element_name, method = observable.split(":")[:3]
+                channel = f"{factory}:{element_name}:{method}"
+                logger.debug('CATAP observing %s for %s from factory %s', method, element_name, factory)
                 if factory == "camera" or factory == "screen":
-                    outputs[observable] = self.fit_image(element_name, method)
+                    # One acquisition per camera serves all of its observables
+                    if element_name not in fits:
+                        with timer.phase("camera"):
+                            fits[element_name] = self.fit_image(element_name)
+                    outputs[observable] = fits[element_name][method]
+                elif channel in errors:
+                    raise errors[channel]
+                elif observable.endswith(":spread"):
+                    outputs[observable] = spreads[channel]
                 else:
-                    element = get_factory(factory).get_hardware(element_name)
-                    outputs[observable] = getattr(element, method)
-                print(f'\tvalue = {outputs[observable]}')
+                    outputs[observable] = values[channel]
+                logger.debug('\tvalue = %s', outputs[observable])
             else:
                 outputs[observable] = 0.
+        # One evaluation runs from the end of the last get_observables to the end of this one
+        outputs.update(timer.observables(observable_names))
+        timer.log(interface=self.name, observables=observable_names)
+        timer.reset()
         return outputs
 
-    def fit_image(self, camera: str, method: str):
-        camera = get_factory['camera'].get_hardware(camera)
-        laser = get_factory['pilaser'].get_hardware('PILaser')
-        get_beam_image_with_background(laser_shutter=laser, camera=camera, scalefactor=1)
+    def get_pipeline(self, camera: str):
+        from image_saving import get_acquisition
+        from pipeline import FramePipeline
+
+        geometry = get_acquisition(camera).geometry
+        pipeline = self._pipelines.get(camera)
+        if pipeline is not None and pipeline.shape != geometry:
+            # The scale factor or ROI changed since the pipeline was built
+            pipeline.close()
+            del self._pipelines[camera]
+        if camera not in self._pipelines:
+            self._pipelines[camera] = FramePipeline(
+                camera,
+                geometry,
+                slots=2 * self.camera_frames,
+                workers=self.pipeline_workers,
+                cut=self.fit_cut,
+                mode=self.fit_mode,
+            )
+        return self._pipelines[camera]
+
+    def fit_image(self, camera: str, method: str | None = None):
+        """Fit the beam on a camera, averaging ``camera_frames`` frames.
+
+        Returns the fitted Gaussian parameters by name, or just ``method`` if given.
+        """
+        from image_saving import get_background_cache, get_beam_image_with_background
+        from image_analysis import fit_array_image, gaussian_parameters
+
+        background_cache = get_background_cache(
+            camera,
+            max_age=self.background_max_age,
+            max_uses=self.background_max_uses,
+            drift_threshold=self.background_drift,
+            frames=self.background_frames,
+        )
+        laser = get_factory('pilaser').get_hardware('PILaser')
+        entry = get_beam_image_with_background(
+            laser_shutter=laser,
+            camera=camera,
+            scalefactor=1,
+            background_cache=background_cache,
+        )
+        fits = [fit_array_image(entry, cut=self.fit_cut, mode=self.fit_mode)]
+        if self.camera_frames > 1:
+            are_shutters_open = laser.shutters_open
+            if not are_shutters_open:
+                laser.open_shutters()
+            pipeline = self.get_pipeline(camera)
+            pipeline.background = entry["background_image_data"]
+            fits += pipeline.collect(self.camera_frames - 1)
+            if not are_shutters_open:
+                laser.close_shutters()
+        result = dict(zip(gaussian_parameters, np.nanmean(np.array(fits), axis=0)))
+        return result if method is None else result[method]
@@ -0,0 +1,117 @@
+import os
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def file_key(path: str) -> str:
+    """Identify a file by its path, modification time and size."""
+    stat = os.stat(path)
+    return hashlib.sha256(
+        f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}".encode("utf-8")
+    ).hexdigest()
+
+
+class FileCache:
+    """Local copies of remote files in a size-limited LRU directory.
+
+    Copies are keyed by :func:`file_key`, so a file rewritten on the share is
+    fetched again rather than served stale.
+    """
+
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 2**32):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def local_path(self, path: str) -> str:
+        local = os.path.join(
+            self.directory, file_key(path) + os.path.splitext(path)[1]
+        )
+        if os.path.isfile(local):
+            os.utime(local)
+            return local
+        # Unique temporary name, so concurrent processes can fill the same cache
+        tmp = f"{local}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, local)
+        self._evict(keep=local)
+        return local
+
+    def _evict(self, keep: str | None = None):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                os.remove(entry.path)
+
+
+class ArrayCache:
+    """Small thread-safe in-memory LRU of decoded image arrays."""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._arrays = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._arrays:
+                return None
+            self._arrays.move_to_end(key)
+            return self._arrays[key]
+
+    def put(self, key, array):
+        if self.max_entries <= 0:
+            return
+        # Shared between callers, so guard against in-place edits
+        array.flags.writeable = False
+        with self._lock:
+            self._arrays[key] = array
+            self._arrays.move_to_end(key)
+            while len(self._arrays) > self.max_entries:
+                self._arrays.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._arrays.clear()
+
+
+_file_cache = None
+
+
+def configure_file_cache(directory: str | os.PathLike | None, max_bytes: int = 2**32):
+    """Cache images read by ``load_image`` under ``directory``; ``None`` disables the cache."""
+    global _file_cache
+    _file_cache = None if directory is None else FileCache(directory, max_bytes)
+    return _file_cache
+
+
+def get_file_cache() -> FileCache | None:
+    global _file_cache
+    if _file_cache is None and os.environ.get("CATAP_IMAGE_CACHE"):
+        configure_file_cache(
+            os.environ["CATAP_IMAGE_CACHE"],
+            int(os.environ.get("CATAP_IMAGE_CACHE_BYTES", 2**32)),
+        )
+    return _file_cache
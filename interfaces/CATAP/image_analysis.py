@@ -1,6 +1,15 @@
+import time
+import logging
+from functools import lru_cache
 import numpy as np
 from scipy.optimize import curve_fit
 from image_saving import load_image
+from file_cache import ArrayCache, file_key
+from interfaces.timing import timer
+
+logger = logging.getLogger(__name__)
+
+gaussian_parameters = ("amplitude", "x0", "y0", "sigma_x", "sigma_y", "offset")
 
 
 def gaussian_2d(xy, amp, x0, y0, sigma_x, sigma_y, offset):
@@ -14,25 +23,62 @@ def gaussian_2d(xy, amp, x0, y0, sigma_x, sigma_y, offset):
     )
 
 
+def gaussian_2d_jacobian(xy, amp, x0, y0, sigma_x, sigma_y, offset):
+    x, y = xy
+    dx = np.ravel(x) - x0
+    dy = np.ravel(y) - y0
+    g = np.exp(-(dx**2 / (2 * sigma_x**2) + dy**2 / (2 * sigma_y**2)))
+    ag = amp * g
+    jac = np.empty((g.size, 6))
+    jac[:, 0] = g
+    jac[:, 1] = ag * dx / sigma_x**2
+    jac[:, 2] = ag * dy / sigma_y**2
+    jac[:, 3] = ag * dx**2 / sigma_x**3
+    jac[:, 4] = ag * dy**2 / sigma_y**3
+    jac[:, 5] = 1.0
+    return jac
+
+
+def gaussian_1d(x, amp, x0, sigma, offset):
+    return offset + amp * np.exp(-((x - x0) ** 2) / (2 * sigma**2))
+
+
+def gaussian_1d_jacobian(x, amp, x0, sigma, offset):
+    dx = x - x0
+    g = np.exp(-(dx**2) / (2 * sigma**2))
+    return np.column_stack(
+        (g, amp * g * dx / sigma**2, amp * g * dx**2 / sigma**3, np.ones_like(g))
+    )
+
+
+@lru_cache(maxsize=8)
+def _grid(shape: tuple[int, int]):
+    """Flattened pixel coordinates for an image shape, shared between fits."""
+    rows, columns = shape
+    x = np.tile(np.arange(columns, dtype=float), rows)
+    y = np.repeat(np.arange(rows, dtype=float), columns)
+    x.flags.writeable = False
+    y.flags.writeable = False
+    return x, y
+
+
 def compute_rms_beam_size(image):
+    # Moments from the projections, so no full index grids are needed
     total = np.sum(image)
-    indices = np.indices(image.shape)
-    x = indices[1]
-    y = indices[0]
-    x_mean = np.sum(x * image) / total
-    y_mean = np.sum(y * image) / total
-    x_rms = np.sqrt(np.sum(((x - x_mean) ** 2) * image) / total)
-    y_rms = np.sqrt(np.sum(((y - y_mean) ** 2) * image) / total)
+    x = np.arange(image.shape[1])
+    y = np.arange(image.shape[0])
+    x_projection = np.sum(image, axis=0)
+    y_projection = np.sum(image, axis=1)
+    x_mean = np.sum(x * x_projection) / total
+    y_mean = np.sum(y * y_projection) / total
+    x_rms = np.sqrt(np.sum(((x - x_mean) ** 2) * x_projection) / total)
+    y_rms = np.sqrt(np.sum(((y - y_mean) ** 2) * y_projection) / total)
     return x_mean, y_mean, x_rms, y_rms
 
 
-def fit_gaussian_beam_size(image):
+def _initial_guess(image):
     x_mean, y_mean, x_rms, y_rms = compute_rms_beam_size(image)
-    y_size, x_size = image.shape
-    x = np.arange(x_size)
-    y = np.arange(y_size)
-    x, y = np.meshgrid(x, y)
-    initial_guess = (
+    return (
         image.max() - image.min(),
         x_mean,
         y_mean,
@@ -40,61 +86,279 @@ def fit_gaussian_beam_size(image):
         y_rms,
         image.min(),
     )
-    popt, pcov = curve_fit(gaussian_2d, (x, y), image.ravel(), p0=initial_guess)
-    amplitude, x0, y0, sigma_x, sigma_y, offset = popt
+
+
+def _quality(data, model) -> dict:
+    residual = data - model
+    ss_res = float(residual @ residual)
+    ss_tot = float(np.sum((data - data.mean()) ** 2))
+    return {
+        "r_squared": 1.0 - ss_res / ss_tot if ss_tot > 0 else float("nan"),
+        "residual_rms": float(np.sqrt(ss_res / data.size)),
+    }
+
+
+def _fit_2d(image, p0=None):
+    xy = _grid(image.shape)
+    data = np.ravel(image).astype(float)
+    popt, pcov = curve_fit(
+        gaussian_2d,
+        xy,
+        data,
+        p0=_initial_guess(image) if p0 is None else p0,
+        jac=gaussian_2d_jacobian,
+    )
+    popt[3:5] = np.abs(popt[3:5])
+    return popt, _quality(data, gaussian_2d(xy, *popt))
+
+
+def _fit_1d(profile):
+    x = np.arange(profile.size, dtype=float)
+    total = profile.sum()
+    mean = np.sum(x * profile) / total
+    rms = np.sqrt(np.sum((x - mean) ** 2 * profile) / total)
+    p0 = (profile.max() - profile.min(), mean, rms, profile.min())
+    popt, pcov = curve_fit(gaussian_1d, x, profile, p0=p0, jac=gaussian_1d_jacobian)
+    popt[2] = abs(popt[2])
+    return popt, _quality(profile, gaussian_1d(x, *popt))
+
+
+def _fit_projections(image):
+    rows, columns = image.shape
+    (amp_x, x0, sigma_x, offset_x), quality_x = _fit_1d(image.sum(axis=0))
+    (amp_y, y0, sigma_y, offset_y), quality_y = _fit_1d(image.sum(axis=1))
+    # Summing amp * exp(-y^2 / 2 sigma_y^2) over rows gives amp * sqrt(2 pi) * sigma_y
+    popt = np.array(
+        [
+            amp_x / (np.sqrt(2 * np.pi) * sigma_y),
+            x0,
+            y0,
+            sigma_x,
+            sigma_y,
+            offset_x / rows,
+        ]
+    )
+    quality = {
+        "r_squared": (quality_x["r_squared"] + quality_y["r_squared"]) / 2,
+        "residual_rms": np.hypot(quality_x["residual_rms"], quality_y["residual_rms"])
+        / np.sqrt(2),
+    }
+    return popt, quality
+
+
+def _profile_moments(profile):
+    # Remove the pedestal so a flat background does not inflate the RMS
+    profile = np.clip(profile - np.median(profile), 0, None)
+    x = np.arange(profile.size)
+    total = profile.sum()
+    if total <= 0:
+        return (profile.size - 1) / 2, profile.size / 2
+    mean = np.sum(x * profile) / total
+    return mean, np.sqrt(np.sum((x - mean) ** 2 * profile) / total)
+
+
+def crop_roi(image, n_sigma: float = 4.0, min_half_width: int = 8, centre=None):
+    """Crop to ``n_sigma`` RMS sizes around the centroid; returns the ROI and its (row, column) origin."""
+    if centre is None:
+        x_mean, x_rms = _profile_moments(image.sum(axis=0))
+        y_mean, y_rms = _profile_moments(image.sum(axis=1))
+    else:
+        x_mean, y_mean, x_rms, y_rms = centre
+    rows, columns = image.shape
+    half_x = max(min_half_width, int(np.ceil(n_sigma * x_rms)))
+    half_y = max(min_half_width, int(np.ceil(n_sigma * y_rms)))
+    c0 = min(max(0, int(round(x_mean)) - half_x), columns - 1)
+    r0 = min(max(0, int(round(y_mean)) - half_y), rows - 1)
+    c1 = min(columns, int(round(x_mean)) + half_x + 1)
+    r1 = min(rows, int(round(y_mean)) + half_y + 1)
+    return image[r0:r1, c0:c1], (r0, c0)
+
+
+fit_modes = ("full", "roi", "projection", "coarse_to_fine")
+
+
+def fit_beam(image, mode: str = "roi", n_sigma: float = 4.0, downsample: int = 4) -> dict:
+    """Fit a 2D Gaussian beam spot.
+
+    Modes:
+        ``full``: 2D fit over every pixel, with an analytic Jacobian.
+        ``roi``: 2D fit over a crop of ``n_sigma`` RMS sizes around the centroid.
+        ``projection``: 1D fits to the x and y projections of that crop.
+        ``coarse_to_fine``: 2D fit of a ``downsample``-binned image, refined at
+        full resolution in a crop around the coarse result.
+
+    Returns the parameters (in full-image pixels, ordered as ``gaussian_parameters``)
+    with the fit quality and the time taken.
+    """
+    with timer.phase("fit"):
+        return _fit_beam(image, mode, n_sigma, downsample)
+
+
+def _fit_beam(image, mode, n_sigma, downsample) -> dict:
+    start = time.perf_counter()
+    image = np.asarray(image, dtype=float)
+    if mode == "full":
+        popt, quality = _fit_2d(image)
+    elif mode in ("roi", "projection"):
+        roi, (r0, c0) = crop_roi(image, n_sigma=n_sigma)
+        popt, quality = (_fit_2d if mode == "roi" else _fit_projections)(roi)
+        popt[1] += c0
+        popt[2] += r0
+    elif mode == "coarse_to_fine":
+        d = max(1, int(downsample))
+        rows, columns = (image.shape[0] // d) * d, (image.shape[1] // d) * d
+        coarse = image[:rows, :columns].reshape(rows // d, d, columns // d, d).mean(axis=(1, 3))
+        p, _ = _fit_2d(coarse)
+        # A binned pixel k covers full pixels k*d .. k*d + d - 1
+        x0, y0 = p[1] * d + (d - 1) / 2, p[2] * d + (d - 1) / 2
+        sigma_x, sigma_y = p[3] * d, p[4] * d
+        roi, (r0, c0) = crop_roi(image, n_sigma=n_sigma, centre=(x0, y0, sigma_x, sigma_y))
+        popt, quality = _fit_2d(roi, p0=(p[0], x0 - c0, y0 - r0, sigma_x, sigma_y, p[5]))
+        popt[1] += c0
+        popt[2] += r0
+    else:
+        raise ValueError(f"Unknown fit mode {mode!r}, expected one of {fit_modes}")
+    return {
+        "popt": popt,
+        "mode": mode,
+        "elapsed": time.perf_counter() - start,
+        **quality,
+    }
+
+
+def fit_gaussian_beam_size(image):
+    with timer.phase("fit"):
+        popt, quality = _fit_2d(np.asarray(image, dtype=float))
     return popt
 
 
-def otsu(gray, scale: float = 2**16):
-    pixel_number = gray.shape[0] * gray.shape[1]
-    mean_weight = 1.0 / pixel_number
-    his, bins = np.histogram(gray, np.arange(0, scale))
-    final_thresh = -1
-    final_value = -1
-    intensity_arr = np.arange(scale - 1)
-    for t in bins[2:-1]:
-        pcb = np.sum(his[:t])
-        pcf = np.sum(his[t:])
-        Wb = pcb * mean_weight
-        Wf = pcf * mean_weight
-
-        mub = np.sum(intensity_arr[:t] * his[:t]) / float(pcb)
-        muf = np.sum(intensity_arr[t:] * his[t:]) / float(pcf)
-        value = Wb * Wf * (mub - muf) ** 2
-
-        if value > final_value:
-            final_thresh = t
-            final_value = value
-    final_img = gray.copy()
-    final_img[gray > final_thresh] = scale
-    final_img[gray < final_thresh] = final_thresh
-    return final_img
+def _histograms(frames, edges):
+    """Histogram each frame of a (frames, pixels) array over uniform ``edges`` in one pass."""
+    bins = len(edges) - 1
+    low, high = edges[0], edges[-1]
+    if (
+        np.issubdtype(frames.dtype, np.integer)
+        and low == 0
+        and high == bins
+        and frames.min() >= 0
+        and frames.max() < bins
+    ):
+        # Unit-width bins from zero and every pixel in range: the value is the bin index
+        if frames.shape[0] == 1:
+            return np.bincount(frames.ravel(), minlength=bins)[None, :]
+        offsets = np.arange(frames.shape[0])[:, None] * bins
+        counts = np.bincount((frames + offsets).ravel(), minlength=frames.shape[0] * bins)
+        return counts.reshape(frames.shape[0], bins)
+    index = np.floor((frames - low) * (bins / (high - low))).astype(np.int64)
+    # The last bin is closed on the right, as in np.histogram
+    index[frames == high] = bins - 1
+    valid = (index >= 0) & (index < bins) & (frames >= low) & (frames <= high)
+    index += np.arange(frames.shape[0])[:, None] * bins
+    counts = np.bincount(index[valid], minlength=frames.shape[0] * bins)
+    return counts.reshape(frames.shape[0], bins)
+
 
+def otsu_threshold(gray, scale: float = 2**16, bins: int | None = None):
+    """Otsu threshold of a frame, or of each frame in a (frames, rows, columns) stack.
 
-def fit_array_image(entry: dict[str, str], cut: int = 1):
+    The between-class variance for every candidate threshold comes from cumulative
+    sums of the histogram. By default there is one bin per integer level below
+    ``scale``; ``bins`` spreads that many uniform bins over [0, scale) instead.
+    Returns -1 where no threshold separates two populated classes.
+    """
+    gray = np.asarray(gray)
+    frames = gray.reshape(-1, gray.shape[-2] * gray.shape[-1])
+    if bins is None:
+        edges = np.arange(0, scale, dtype=float)
+    else:
+        edges = np.linspace(0, scale, bins + 1)
+    his = _histograms(frames, edges)
+    # Thresholds above the highest populated bin leave an empty upper class, so drop them
+    populated = np.flatnonzero(his.any(axis=0))
+    his = his[:, : populated[-1] + 1 if populated.size else 0].astype(float)
+    if his.shape[1] < 3:
+        thresholds = np.full(frames.shape[0], -1.0)
+        return thresholds[0] if gray.ndim == 2 else thresholds
+    levels = edges[: his.shape[1]]
+
+    below = np.cumsum(his, axis=1)
+    below_sum = np.cumsum(his * levels, axis=1)
+    # Candidate thresholds are edges[2:-1]; class "below" holds bins [0, t)
+    t = np.arange(2, his.shape[1])
+    pcb = below[:, t - 1]
+    pcf = below[:, -1:] - pcb
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mub = below_sum[:, t - 1] / pcb
+        muf = (below_sum[:, -1:] - below_sum[:, t - 1]) / pcf
+        value = pcb * pcf * (mub - muf) ** 2
+    value[~np.isfinite(value)] = -np.inf
+
+    best = np.argmax(value, axis=1)
+    thresholds = np.where(
+        np.isfinite(value[np.arange(len(best)), best]), edges[t[best]], -1.0
+    )
+    return thresholds[0] if gray.ndim == 2 else thresholds
+
+
+def otsu(gray, scale: float = 2**16, bins: int | None = None):
+    """Set pixels above the Otsu threshold to ``scale`` and those below it to the threshold."""
+    final_thresh = otsu_threshold(gray, scale=scale, bins=bins)
+    if np.ndim(final_thresh):
+        final_thresh = final_thresh[:, None, None]
+    final_img = gray.copy()
+    above = gray > final_thresh
+    below = gray < final_thresh
+    final_img[above] = scale
+    final_img[below] = np.broadcast_to(final_thresh, gray.shape)[below]
+    return final_img
 
-    img = entry["image_data"]
-    if "background_image_data" in entry:
-        bg = entry["background_image_data"]
 
-    if bg:
+def preprocess_image(img, bg=None, cut: int = 1):
+    """Background-subtract, Otsu-threshold and sub-sample an image ready for fitting."""
+    if bg is not None:
         img_sub = img.astype(float) - bg.astype(float)
     else:
         img_sub = img.astype(float)
 
     img_sub[img_sub < 0] = 0
 
-    img_sub_otsu = otsu(img_sub)
-    img_sub_sub = img_sub_otsu[::cut, ::cut]
+    with timer.phase("otsu"):
+        img_sub_otsu = otsu(img_sub)
+    return img_sub_otsu[::cut, ::cut]
 
-    fit_x, fit_y, popt = fit_gaussian_beam_size(img_sub_sub)
-    fit_x *= cut
-    fit_y *= cut
-    popt *= cut
+
+def fit_array_image(entry: dict[str, str], cut: int = 1, mode: str | None = None):
+
+    img_sub_sub = preprocess_image(
+        entry["image_data"], entry.get("background_image_data"), cut
+    )
+
+    if mode is None:
+        popt = fit_gaussian_beam_size(img_sub_sub)
+    else:
+        popt = fit_beam(img_sub_sub, mode=mode)["popt"]
+    # Positions and widths were fitted on the sub-sampled grid
+    popt[1:5] *= cut
 
     return popt
 
 
+_subtracted_images = ArrayCache(max_entries=16)
+
+
+def load_subtracted_image(img_path: str, bg_path: str | None = None):
+    """Background-subtracted image from saved files, memoised on path, mtime and size."""
+    key = (file_key(img_path), file_key(bg_path) if bg_path else None)
+    img_sub = _subtracted_images.get(key)
+    if img_sub is None:
+        img_sub = load_image(img_path).astype(float)
+        if bg_path:
+            img_sub -= load_image(bg_path).astype(float)
+        img_sub[img_sub < 0] = 0
+        _subtracted_images.put(key, img_sub)
+    return img_sub
+
+
 def fit_saved_image(entry: dict[str, str], cut: int = 1):
     base_image_path = "\\\\claraserv3.dl.ac.uk"
     img_path = base_image_path + entry["image_file"] + "_full.hdf"
@@ -104,25 +368,15 @@ def fit_saved_image(entry: dict[str, str], cut: int = 1):
         bg_path = False
 
     try:
-        img = load_image(img_path)
-        if bg_path:
-            bg = load_image(bg_path)
+        img_sub = load_subtracted_image(img_path, bg_path)
     except Exception as e:
-        print(f"Skipping {img_path} or {bg_path}: {e}")
-
-    if bg_path:
-        img_sub = img.astype(float) - bg.astype(float)
-    else:
-        img_sub = img.astype(float)
-
-    img_sub[img_sub < 0] = 0
+        logger.warning("Skipping %s or %s: %s", img_path, bg_path, e)
+        return None
 
-    img_sub_otsu = otsu(img_sub)
-    img_sub_sub = img_sub_otsu[::cut, ::cut]
+    img_sub_sub = preprocess_image(img_sub, cut=cut)
 
-    fit_x, fit_y, popt = fit_gaussian_beam_size(img_sub_sub)
-    fit_x *= cut
-    fit_y *= cut
-    popt *= cut
+    popt = fit_gaussian_beam_size(img_sub_sub)
+    # Positions and widths were fitted on the sub-sampled grid
+    popt[1:5] *= cut
 
     return popt
@@ -1,67 +1,273 @@
 import os
 import time
-import h5py
-from epics import caput, caget
-import numpy as np
+import atexit
+import logging
+from file_cache import get_file_cache
+from interfaces.timing import timer
+
+logger = logging.getLogger(__name__)
 
 
 def get_camera_ArraySize0(camera_name: str):
+    from epics import caget
+
     return caget(camera_name + ":CAM2:ArraySize0_RBV")
 
 
 def get_camera_ArraySize1(camera_name: str):
+    from epics import caget
+
     return caget(camera_name + ":CAM2:ArraySize1_RBV")
 
 
 def get_camera_ScaleFactor(camera_name: str):
-    caget(camera_name + ":CAM:ScaleFactor")
+    from epics import caget
+
+    return caget(camera_name + ":CAM:ScaleFactor")
 
 
 def set_camera_ScaleFactor(camera_name: str, scalefactor: int = 1):
+    from epics import caput
+
     caput(camera_name + ":CAM:ScaleFactor", scalefactor)
     time.sleep(0.1)
 
 
+class CameraAcquisition:
+    """Persistent PV connections to one camera, with its geometry and scale factor cached.
+
+    The scale factor is only written when it differs from the current one; the
+    original value is put back by :meth:`restore`.
+    """
+
+    def __init__(self, camera_name: str, timeout: float = 2.0):
+        from epics import PV
+
+        self.camera_name = camera_name
+        self.timeout = timeout
+        self._geometry = None
+        self._scalefactor = None
+        self._original_scalefactor = None
+        self._size0 = PV(
+            camera_name + ":CAM2:ArraySize0_RBV", auto_monitor=True, callback=self._invalidate
+        )
+        self._size1 = PV(
+            camera_name + ":CAM2:ArraySize1_RBV", auto_monitor=True, callback=self._invalidate
+        )
+        self._scale = PV(
+            camera_name + ":CAM:ScaleFactor", auto_monitor=True, callback=self._scale_changed
+        )
+        self._data = PV(camera_name + ":CAM2:ArrayData", auto_monitor=False)
+
+    def _invalidate(self, **kwargs):
+        self._geometry = None
+
+    def _scale_changed(self, value=None, **kwargs):
+        self._scalefactor = value
+        self._geometry = None
+
+    @property
+    def geometry(self) -> tuple[int, int]:
+        """Frame shape as (rows, columns)."""
+        if self._geometry is None:
+            size0 = self._size0.get(timeout=self.timeout, use_monitor=False)
+            size1 = self._size1.get(timeout=self.timeout, use_monitor=False)
+            if size0 is None or size1 is None:
+                raise TimeoutError(f"Could not read the frame size of {self.camera_name}")
+            self._geometry = (int(size1), int(size0))
+        return self._geometry
+
+    @property
+    def scalefactor(self):
+        if self._scalefactor is None:
+            self._scalefactor = self._scale.get(timeout=self.timeout)
+        return self._scalefactor
+
+    def set_scalefactor(self, scalefactor: int):
+        scalefactor = int(max(0, min(4, scalefactor)))
+        current = self.scalefactor
+        if current is not None and int(current) == scalefactor:
+            return
+        if self._original_scalefactor is None:
+            self._original_scalefactor = current
+        self._scale.put(scalefactor, wait=True)
+        self._scalefactor = scalefactor
+        self._geometry = None
+        time.sleep(0.1)
+
+    def frame(self, scalefactor: int | None = None):
+        """Fetch one frame, reshaped in place to the camera geometry."""
+        if scalefactor is not None:
+            self.set_scalefactor(scalefactor)
+        rows, columns = self.geometry
+        with timer.phase("transfer"):
+            data = self._data.get(count=rows * columns, as_numpy=True, timeout=self.timeout)
+        if data is None:
+            raise TimeoutError(f"No frame received from {self.camera_name}")
+        return data.reshape((rows, columns))
+
+    def restore(self):
+        if self._original_scalefactor is not None:
+            self.set_scalefactor(self._original_scalefactor)
+            self._original_scalefactor = None
+
+    def close(self):
+        self.restore()
+        for pv in (self._size0, self._size1, self._scale, self._data):
+            pv.clear_callbacks()
+            pv.disconnect()
+
+
+_acquisitions = {}
+
+
+def get_acquisition(camera_name: str) -> CameraAcquisition:
+    if camera_name not in _acquisitions:
+        if not _acquisitions:
+            # Cameras are put back on exit if nothing closed them earlier
+            atexit.register(close_acquisitions)
+        _acquisitions[camera_name] = CameraAcquisition(camera_name)
+    return _acquisitions[camera_name]
+
+
+def close_acquisitions():
+    """Restore the scale factor of every camera used and release its PV connections."""
+    atexit.unregister(close_acquisitions)
+    while _acquisitions:
+        camera_name, acquisition = _acquisitions.popitem()
+        try:
+            acquisition.close()
+        except Exception as e:
+            logger.warning("Could not restore camera %s: %s", camera_name, e)
+
+
 def get_data_array(camera_name, scalefactor: int = 4):
-    original_scalefactor = get_camera_ScaleFactor(camera_name=camera_name)
-    scalefactor = max(0, min(4, scalefactor))
-    set_camera_ScaleFactor(camera_name=camera_name, scalefactor=int(scalefactor))
-    size0 = get_camera_ArraySize0(camera_name=camera_name)
-    size1 = get_camera_ArraySize1(camera_name=camera_name)
-    data = caget(camera_name + ":CAM2:ArrayData", count=size0 * size1)
-    set_camera_ScaleFactor(
-        camera_name=camera_name, scalefactor=int(original_scalefactor)
-    )
-    return np.array(data).reshape((size1, size0))
+    return get_acquisition(camera_name).frame(scalefactor)
 
 
 def get_beam_image(laser_shutter, camera, scalefactor: int = 4):
-    laser_shutter.open_shutters()
+    if not laser_shutter.shutters_open:
+        with timer.phase("shutter"):
+            laser_shutter.open_shutters()
     return {"image_data": get_data_array(camera, scalefactor)}
 
 
 def get_background_image(laser_shutter, camera, scalefactor: int = 4):
-    laser_shutter.close_shutters()
+    with timer.phase("shutter"):
+        laser_shutter.close_shutters()
     return {"background_image_data": get_data_array(camera, scalefactor)}
 
 
-def get_beam_image_with_background(laser_shutter, camera, scalefactor: int = 4):
+class BackgroundCache:
+    """Background frame for one camera, reused between evaluations until it goes stale.
+
+    A refresh is due when the background is older than ``max_age`` seconds, has
+    been used ``max_uses`` times, or the mean level of the frame border (assumed
+    beam-free) has moved by more than ``drift_threshold`` counts since it was taken.
+    ``frames`` backgrounds are averaged on each refresh. A background whose
+    shape no longer matches the beam frame, e.g. after a scale factor or ROI
+    change, is always refreshed.
+    """
+
+    def __init__(
+        self,
+        max_age: float | None = 300.0,
+        max_uses: int | None = 50,
+        drift_threshold: float | None = None,
+        frames: int = 1,
+        border: int = 16,
+    ):
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.drift_threshold = drift_threshold
+        self.frames = frames
+        self.border = border
+        self.background = None
+        self.taken = None
+        self.uses = 0
+        self.level = None
+
+    def border_level(self, frame) -> float:
+        b = max(1, min(self.border, min(frame.shape) // 4))
+        return float(
+            (
+                frame[:b].sum(dtype=float)
+                + frame[-b:].sum(dtype=float)
+                + frame[b:-b, :b].sum(dtype=float)
+                + frame[b:-b, -b:].sum(dtype=float)
+            )
+            / (2 * b * frame.shape[1] + 2 * b * (frame.shape[0] - 2 * b))
+        )
+
+    def expired(self) -> bool:
+        if self.background is None:
+            return True
+        if self.max_age is not None and time.time() - self.taken > self.max_age:
+            return True
+        return self.max_uses is not None and self.uses >= self.max_uses
+
+    def drifted(self, frame) -> bool:
+        if self.background is None or self.background.shape != frame.shape:
+            return True
+        if self.drift_threshold is None or self.level is None:
+            return False
+        return abs(self.border_level(frame) - self.level) > self.drift_threshold
+
+    def refresh(self, laser_shutter, camera, scalefactor: int = 4):
+        with timer.phase("shutter"):
+            laser_shutter.close_shutters()
+        background = get_data_array(camera, scalefactor).astype(float)
+        for _ in range(self.frames - 1):
+            background += get_data_array(camera, scalefactor)
+        background /= max(self.frames, 1)
+        self.background = background
+        self.taken = time.time()
+        self.uses = 0
+        self.level = self.border_level(background)
+
+
+_background_caches = {}
+
+
+def get_background_cache(camera_name: str, **policy) -> BackgroundCache:
+    """The background cache of a camera, with ``policy`` applied to it if it already exists."""
+    if camera_name not in _background_caches:
+        _background_caches[camera_name] = BackgroundCache(**policy)
+    background_cache = _background_caches[camera_name]
+    for name, value in policy.items():
+        setattr(background_cache, name, value)
+    return background_cache
+
+
+def get_beam_image_with_background(
+    laser_shutter, camera, scalefactor: int = 4, background_cache=None
+):
     are_shutters_open = laser_shutter.shutters_open
     output = {}
-    output.update(
-        get_background_image(
-            laser_shutter=laser_shutter, camera=camera, scalefactor=scalefactor
+    if background_cache is None:
+        output.update(
+            get_background_image(
+                laser_shutter=laser_shutter, camera=camera, scalefactor=scalefactor
+            )
         )
-    )
+    elif background_cache.expired():
+        background_cache.refresh(laser_shutter, camera, scalefactor)
     output.update(
         get_beam_image(
             laser_shutter=laser_shutter, camera=camera, scalefactor=scalefactor
         )
     )
-    if are_shutters_open:
-        laser_shutter.open_shutters()
-    else:
-        laser_shutter.close_shutters()
+    if background_cache is not None:
+        if background_cache.drifted(output["image_data"]):
+            background_cache.refresh(laser_shutter, camera, scalefactor)
+        background_cache.uses += 1
+        output["background_image_data"] = background_cache.background
+    if laser_shutter.shutters_open != are_shutters_open:
+        with timer.phase("shutter"):
+            if are_shutters_open:
+                laser_shutter.open_shutters()
+            else:
+                laser_shutter.close_shutters()
     return output
 
 
@@ -76,7 +282,7 @@ def save_image(camera):
         camera.save(num_images=1, timeout=1)
         filename = os.path.join(camera.hdf_filepath, camera.hdf_filename)
     if not filename:
-        print("####  IMAGE ERROR - CARRYING ON  ####")
+        logger.error("No image saved from %s, carrying on", camera)
         return None
     return filename
 
@@ -101,10 +307,15 @@ def save_image_with_background(laser_shutter, camera):
     return {"background_image_file": background_image_file, "image_file": image_file}
 
 
-def load_image(image_path, dataset_name="Capture000001"):
-    """Load image from HDF5 file."""
+def load_image(image_path, dataset_name="Capture000001", cache: bool = True):
+    """Load image from HDF5 file, through the local file cache if one is configured."""
     if not os.path.isfile(image_path):
         raise FileNotFoundError(f"Image file not found: {image_path}")
+    file_cache = get_file_cache() if cache else None
+    if file_cache is not None:
+        image_path = file_cache.local_path(image_path)
+    import h5py
+
     with h5py.File(image_path, "r") as f:
         if dataset_name in f:
             img = f[dataset_name][:]
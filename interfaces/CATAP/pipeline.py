@@ -0,0 +1,107 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from image_analysis import fit_array_image
+from interfaces.timing import timer
+
+logger = logging.getLogger(__name__)
+
+
+class FramePipeline:
+    """Stream camera frames into a preallocated ring buffer and fit them on a worker pool.
+
+    During :meth:`collect` a Channel Access monitor on the array PV copies each
+    new frame into a free slot and hands it to the pool, so frame transfer
+    overlaps with the analysis of earlier frames. Frames arriving while every
+    slot is busy are dropped. The monitor is only subscribed while collecting,
+    so frames do not stream between evaluations; ``shape`` is fixed, so a
+    pipeline must be replaced when the camera geometry changes.
+    """
+
+    def __init__(
+        self,
+        camera_name: str,
+        shape: tuple[int, int],
+        slots: int = 8,
+        workers: int = 4,
+        cut: int = 1,
+        mode: str | None = None,
+    ):
+        self.camera_name = camera_name
+        self.shape = shape
+        self.cut = cut
+        self.mode = mode
+        self.background = None
+        self.dropped = 0
+        self._buffer = np.empty((slots,) + tuple(shape))
+        self._free = deque(range(slots))
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._wanted = 0
+        self._skip = 0
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _on_frame(self, value=None, **kwargs):
+        with self._lock:
+            if self._skip:
+                self._skip -= 1
+                return
+            if len(self._futures) >= self._wanted or value is None:
+                return
+            if not self._free:
+                self.dropped += 1
+                return
+            slot = self._free.popleft()
+            np.copyto(self._buffer[slot], np.reshape(value, self.shape))
+            self._futures.append(self._executor.submit(self._analyse, slot))
+            if len(self._futures) >= self._wanted:
+                self._done.set()
+
+    def _analyse(self, slot: int):
+        try:
+            entry = {"image_data": self._buffer[slot]}
+            if self.background is not None:
+                entry["background_image_data"] = self.background
+            return fit_array_image(entry, cut=self.cut, mode=self.mode)
+        finally:
+            with self._lock:
+                self._free.append(slot)
+
+    def collect(self, frames: int, timeout: float = 10.0) -> list:
+        """Analyse the next ``frames`` frames and return the fits that succeeded."""
+        from epics import PV
+
+        with self._lock:
+            self._futures = []
+            self._done.clear()
+            self._wanted = frames
+            # A new subscription first delivers the frame already on the PV
+            self._skip = 1
+        pv = PV(
+            self.camera_name + ":CAM2:ArrayData",
+            count=self.shape[0] * self.shape[1],
+            auto_monitor=True,
+            callback=self._on_frame,
+        )
+        try:
+            with timer.phase("pipeline"):
+                self._done.wait(timeout)
+        finally:
+            pv.clear_callbacks()
+            pv.disconnect()
+            with self._lock:
+                self._wanted = 0
+                futures = list(self._futures)
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.warning("Frame fit failed on %s: %s", self.camera_name, e)
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
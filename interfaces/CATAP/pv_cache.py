@@ -0,0 +1,80 @@
+import time
+import threading
+
+
+def read_pvs(pvnames: list[str], timeout: float = 1.0) -> dict:
+    """Read many PVs with one batched Channel Access request; unreachable PVs map to None."""
+    if not pvnames:
+        return {}
+    from epics import caget_many
+
+    return dict(zip(pvnames, caget_many(pvnames, timeout=timeout)))
+
+
+class MonitorCache:
+    """Latest value and arrival time for PVs kept under Channel Access monitors.
+
+    A connected PV whose monitor has delivered a value is always current, however
+    long ago it last changed. ``max_age`` only limits values that no live monitor
+    keeps up to date: those of disconnected PVs and those stored by :meth:`update`.
+    """
+
+    def __init__(self, max_age: float | None = 2.0):
+        self.max_age = max_age
+        self._pvs = {}
+        self._values = {}
+        # PVs whose monitor has delivered a value since they last connected
+        self._live = set()
+        self._lock = threading.Lock()
+
+    def _callback(self, pvname=None, value=None, **kwargs):
+        with self._lock:
+            self._values[pvname] = (value, time.time())
+            self._live.add(pvname)
+
+    def _connection(self, pvname=None, conn=None, **kwargs):
+        if not conn:
+            with self._lock:
+                self._live.discard(pvname)
+
+    def monitor(self, pvnames):
+        from epics import PV
+
+        for pvname in pvnames:
+            if pvname not in self._pvs:
+                self._pvs[pvname] = PV(
+                    pvname,
+                    auto_monitor=True,
+                    callback=self._callback,
+                    connection_callback=self._connection,
+                )
+
+    def update(self, values: dict):
+        now = time.time()
+        with self._lock:
+            for pvname, value in values.items():
+                if value is not None:
+                    self._values[pvname] = (value, now)
+
+    def get(self, pvname: str):
+        """Cached value, or None if it is missing, or stale and not kept current by a monitor."""
+        pv = self._pvs.get(pvname)
+        with self._lock:
+            entry = self._values.get(pvname)
+            live = pvname in self._live
+        if entry is None:
+            return None
+        value, received = entry
+        if pv is not None and live and pv.connected:
+            return value
+        if self.max_age is not None and time.time() - received > self.max_age:
+            return None
+        return value
+
+    def clear(self):
+        for pv in self._pvs.values():
+            pv.clear_callbacks()
+            pv.disconnect()
+        self._pvs.clear()
+        self._values.clear()
+        self._live.clear()
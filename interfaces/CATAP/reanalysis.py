@@ -0,0 +1,269 @@
+"""Re-fit saved camera images in parallel.
+
+    python reanalysis.py captures/ -o results.h5 --mode roi
+    python reanalysis.py manifest.json -o results.h5 --base-path //claraserv3.dl.ac.uk --suffix _full.hdf
+
+The input is a directory of image files, or a manifest: either a JSON list of
+``{"image_file": ..., "background_image_file": ...}`` entries as returned by
+``save_image_with_background`` or a text file with ``image[,background]`` per line.
+Fits are written to one columnar HDF5 file. Entries already in that file are
+skipped, so an interrupted run can simply be restarted; with ``--retry-failed``
+failed entries are fitted again and their rows replaced.
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import h5py
+import numpy as np
+
+# Run as a script, the plugin root is not on the path for the shared interfaces modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from file_cache import get_file_cache  # noqa: E402
+from image_analysis import fit_beam, fit_modes, gaussian_parameters, preprocess_image  # noqa: E402
+
+text_columns = ("image_file", "background_image_file", "status", "error")
+value_columns = gaussian_parameters + ("r_squared", "residual_rms", "elapsed")
+
+
+def read_image(path: str, dataset_name: str = "Capture000001"):
+    """Read an image dataset without an intermediate copy.
+
+    Contiguous, uncompressed datasets are memory-mapped; anything else is read
+    chunk by chunk straight into one preallocated array.
+    """
+    file_cache = get_file_cache()
+    if file_cache is not None:
+        path = file_cache.local_path(path)
+    with h5py.File(path, "r") as f:
+        ds = f[dataset_name] if dataset_name in f else f[list(f.keys())[0]]
+        offset = ds.id.get_offset()
+        if ds.chunks is not None or ds.compression is not None or offset is None:
+            img = np.empty(ds.shape, dtype=ds.dtype)
+            if img.size:
+                ds.read_direct(img)
+            return img
+        shape, dtype = ds.shape, ds.dtype
+    return np.memmap(path, mode="r", dtype=dtype, offset=offset, shape=shape)
+
+
+def resolve_path(name: str | None, base_path: str = "", suffix: str = ""):
+    if not name:
+        return None
+    if os.path.isfile(name):
+        return name
+    return base_path + name + suffix
+
+
+def load_manifest(path: str, base_path: str = "", suffix: str = "") -> list[dict]:
+    with open(path) as f:
+        if path.endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = []
+            for line in f:
+                fields = [field.strip() for field in line.split(",")]
+                if fields[0] and not fields[0].startswith("#"):
+                    entries.append(
+                        {
+                            "image_file": fields[0],
+                            "background_image_file": fields[1] if len(fields) > 1 else None,
+                        }
+                    )
+    return [
+        {
+            "image_file": resolve_path(entry["image_file"], base_path, suffix),
+            "background_image_file": resolve_path(
+                entry.get("background_image_file"), base_path, suffix
+            ),
+        }
+        for entry in entries
+        if entry.get("image_file")
+    ]
+
+
+def find_images(directory: str, pattern: str = "*.hdf", background: str | None = None) -> list[dict]:
+    return [
+        {"image_file": path, "background_image_file": background}
+        for path in sorted(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+        if path != background
+    ]
+
+
+def analyse_entry(entry: dict, cut: int = 1, mode: str = "roi", dataset_name: str = "Capture000001") -> dict:
+    """Fit one saved image; failures are returned as a row with ``status="error"``."""
+    row = {
+        "image_file": entry["image_file"],
+        "background_image_file": entry.get("background_image_file") or "",
+        "status": "ok",
+        "error": "",
+    }
+    start = time.perf_counter()
+    try:
+        img = read_image(entry["image_file"], dataset_name)
+        bg = None
+        if entry.get("background_image_file"):
+            bg = read_image(entry["background_image_file"], dataset_name)
+        result = fit_beam(preprocess_image(img, bg, cut), mode=mode)
+        popt = result["popt"]
+        popt[1:5] *= cut
+        row.update(zip(gaussian_parameters, popt))
+        row["r_squared"] = result["r_squared"]
+        row["residual_rms"] = result["residual_rms"]
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = repr(e)
+    row["elapsed"] = time.perf_counter() - start
+    return row
+
+
+class ResultStore:
+    """Columnar HDF5 results: one resizable dataset per column, one row per image."""
+
+    def __init__(self, filename: str, compression: str = "gzip"):
+        self.filename = filename
+        self.compression = compression
+        self._rows = None
+
+    def _row_index(self, f) -> dict:
+        if self._rows is None:
+            files = f["image_file"].asstr()[:] if "image_file" in f else []
+            self._rows = {name: index for index, name in enumerate(files)}
+        return self._rows
+
+    def processed(self, retry_failed: bool = False) -> set:
+        if not os.path.isfile(self.filename):
+            return set()
+        with h5py.File(self.filename, "r") as f:
+            if "image_file" not in f:
+                return set()
+            files = f["image_file"].asstr()[:]
+            if not retry_failed:
+                return set(files)
+            return set(files[f["status"].asstr()[:] == "ok"])
+
+    def write(self, rows: list[dict]):
+        """Store ``rows``, replacing the existing row of any image fitted again."""
+        if not rows:
+            return
+        with h5py.File(self.filename, "a") as f:
+            index = self._row_index(f)
+            n = len(index)
+            positions = {}
+            for row in rows:
+                position = index.setdefault(row["image_file"], len(index))
+                positions[position] = row
+            order = sorted(positions)
+            rows = [positions[position] for position in order]
+            for column in text_columns + value_columns:
+                if column in text_columns:
+                    data = np.array([row.get(column, "") for row in rows], dtype=object)
+                    dtype = h5py.string_dtype()
+                else:
+                    data = np.array([row.get(column, np.nan) for row in rows], dtype=float)
+                    dtype = float
+                if column not in f:
+                    f.create_dataset(
+                        column,
+                        shape=(n,),
+                        maxshape=(None,),
+                        dtype=dtype,
+                        chunks=(1024,),
+                        compression=self.compression,
+                    )
+                dset = f[column]
+                if dset.shape[0] < len(index):
+                    dset.resize((len(index),))
+                dset[order] = data
+
+
+def reanalyse(
+    entries: list[dict],
+    output: str,
+    workers: int | None = None,
+    cut: int = 1,
+    mode: str = "roi",
+    dataset_name: str = "Capture000001",
+    chunksize: int = 8,
+    flush_every: int = 64,
+    retry_failed: bool = False,
+) -> dict:
+    """Fit every entry not yet in ``output`` on a process pool; returns a count per status."""
+    store = ResultStore(output)
+    done = store.processed(retry_failed)
+    pending = [entry for entry in entries if entry["image_file"] not in done]
+    counts = {"skipped": len(entries) - len(pending), "ok": 0, "error": 0}
+    print(f"{len(pending)} images to analyse, {counts['skipped']} already processed")
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                analyse_entry,
+                pending,
+                [cut] * len(pending),
+                [mode] * len(pending),
+                [dataset_name] * len(pending),
+                chunksize=chunksize,
+            )
+            for row in results:
+                counts[row["status"]] += 1
+                if row["status"] != "ok":
+                    print(f"Failed on {row['image_file']}: {row['error']}")
+                rows.append(row)
+                if len(rows) >= flush_every:
+                    store.write(rows)
+                    rows = []
+    except BrokenProcessPool as e:
+        # A worker died outright (e.g. inside the HDF5 library); keep what has been fitted
+        print(f"Worker pool failed, stopping early: {e}")
+    finally:
+        store.write(rows)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-fit saved camera images in parallel.")
+    parser.add_argument("source", help="Directory of image files or a manifest (.json, or text)")
+    parser.add_argument("-o", "--output", required=True, help="Columnar HDF5 results file")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--mode", default="roi", choices=fit_modes)
+    parser.add_argument("--cut", type=int, default=1, help="Pixel sub-sampling before fitting")
+    parser.add_argument("--dataset", default="Capture000001", help="Image dataset name")
+    parser.add_argument("--pattern", default="*.hdf", help="File pattern when source is a directory")
+    parser.add_argument("--background", default=None, help="Background file for every image in a directory")
+    parser.add_argument("--base-path", default="", help="Prefix for manifest file names")
+    parser.add_argument("--suffix", default="", help="Suffix for manifest file names")
+    parser.add_argument("--chunksize", type=int, default=8, help="Images sent to a worker at a time")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-fit entries that previously failed")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.source):
+        entries = find_images(args.source, args.pattern, args.background)
+    else:
+        entries = load_manifest(args.source, args.base_path, args.suffix)
+    start = time.perf_counter()
+    counts = reanalyse(
+        entries,
+        args.output,
+        workers=args.workers,
+        cut=args.cut,
+        mode=args.mode,
+        dataset_name=args.dataset,
+        chunksize=args.chunksize,
+        retry_failed=args.retry_failed,
+    )
+    print(
+        f"{counts['ok']} fitted, {counts['error']} failed, {counts['skipped']} skipped "
+        f"in {time.perf_counter() - start:.1f} s"
+    )
+    return 0 if counts["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import numpy as np
+
+statistics = ("mean", "median", "clipped")
+
+
+def sigma_clipped_mean(samples, sigma: float = 3.0, iterations: int = 5):
+    """Mean and standard deviation of each column after iterative sigma clipping.
+
+    NaN entries are ignored, so columns may hold different numbers of samples.
+    """
+    data = np.asarray(samples, dtype=float)
+    mask = np.isfinite(data)
+    for _ in range(iterations):
+        count = np.maximum(mask.sum(axis=0), 1)
+        mean = np.where(mask, data, 0.0).sum(axis=0) / count
+        std = np.sqrt(np.where(mask, (data - mean) ** 2, 0.0).sum(axis=0) / count)
+        keep = mask & (np.abs(data - mean) <= sigma * std)
+        if np.array_equal(keep, mask):
+            break
+        mask = keep
+    count = mask.sum(axis=0)
+    valid = count > 0
+    safe = np.maximum(count, 1)
+    mean = np.where(mask, data, 0.0).sum(axis=0) / safe
+    std = np.sqrt(np.where(mask, (data - mean) ** 2, 0.0).sum(axis=0) / safe)
+    return np.where(valid, mean, np.nan), np.where(valid, std, np.nan)
+
+
+def robust_statistic(samples, statistic: str = "mean", sigma: float = 3.0):
+    """Centre and spread of each column of a (shots, channels) sample buffer."""
+    data = np.asarray(samples, dtype=float)
+    if statistic == "mean":
+        return np.nanmean(data, axis=0), np.nanstd(data, axis=0)
+    elif statistic == "median":
+        median = np.nanmedian(data, axis=0)
+        # Scaled median absolute deviation, comparable to a standard deviation
+        return median, 1.4826 * np.nanmedian(np.abs(data - median), axis=0)
+    elif statistic == "clipped":
+        return sigma_clipped_mean(data, sigma=sigma)
+    raise ValueError(f"Unknown shot statistic {statistic!r}, expected one of {statistics}")
@@ -1,9 +1,19 @@
 import os
 import re
+import glob
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
 from badger import interface
-from SimulationFramework import Framework
 from tempfile import TemporaryDirectory
 from pydantic import Field
+from .cache import ResultCache, cache_key, settings_fingerprint
+from .checkpoints import CheckpointStore
+from .beam_statistics import beam_statistics
+from .supervisor import TrackingSupervisor, TrackResult, kill_on_terminate
+from interfaces.timing import timer
+
+logger = logging.getLogger(__name__)
 
 beam_evaluate = (
     "sigma_x",
@@ -40,18 +50,98 @@ class SimFrameInterface(interface.Interface):
     )
     prefix: str | None = Field(default=".", description="SimFrame prefix")
     sampling: int = Field(default=3, description="SimFrame sub-sampling")
+    fidelity_sampling: list[int] = Field(
+        default=[],
+        description="Sub-sampling for each fidelity level, lowest fidelity first",
+    )
+    cache_size: int = Field(
+        default=128, description="Number of tracking results kept in memory"
+    )
+    cache_dir: str | None = Field(
+        default=None, description="Directory for the on-disk result cache"
+    )
+    cache_max_bytes: int = Field(
+        default=2**30, description="Size limit of the on-disk result cache"
+    )
+    workers: int = Field(
+        default=1, description="Worker processes used by evaluate_batch"
+    )
+    checkpoints: int = Field(
+        default=0,
+        description="Upstream configurations checkpointed at each lattice boundary",
+    )
+    lazy_beams: bool = Field(
+        default=True,
+        description="Only load the beams and statistics that are requested",
+    )
+    scratch_dir: str | None = Field(
+        default=None,
+        description="Directory for tracking working files, e.g. a RAM disk",
+    )
+    archive_file: str | None = Field(
+        default=None, description="HDF5 file that evaluation results are appended to"
+    )
+    archive_screens: list[str] = Field(
+        default=[],
+        description="Screens whose beams are archived, default the requested ones",
+    )
+    supervised: bool = Field(
+        default=False,
+        description="Track in a child process that can time out or be cancelled",
+    )
+    timeout: float | None = Field(
+        default=None, description="Wall-clock limit in seconds for a supervised run"
+    )
+    fast_statistics: bool = Field(
+        default=False,
+        description="Compute beam statistics in a single vectorised pass",
+    )
+    timing: bool = Field(
+        default=False,
+        description="Record per-phase wall times, readable as timing:<phase> observables",
+    )
+    timing_log: str | None = Field(
+        default=None, description="JSON-lines file receiving the phase times of each evaluation"
+    )
 
     # Private variables
     _states: dict
+    _inputs: dict
+    _framework: object
+    _framework_key: tuple | None
+    _framework_defaults: dict
+    _cache: ResultCache
+    _pool: ProcessPoolExecutor | None
+    _pool_workers: int
+    _checkpoints: CheckpointStore | None
+    _checkpoint_dir: TemporaryDirectory | None
+    _supervisor: TrackingSupervisor | None
+    _last_result: TrackResult | None
 
     def __init__(self, **data):
         super().__init__(**data)
         # print("SimFrameInterface init", data)
         self._states = {}
+        self._inputs = {}
+        self._framework = None
+        self._framework_key = None
+        self._framework_defaults = {}
+        self._cache = ResultCache(
+            max_entries=self.cache_size,
+            directory=self.cache_dir,
+            max_bytes=self.cache_max_bytes,
+        )
+        self._pool = None
+        self._pool_workers = 0
+        self._checkpoints = None
+        self._checkpoint_dir = None
+        self._supervisor = None
+        self._last_result = None
 
     def set_values(self, channel_inputs):
         for channel, value in channel_inputs.items():
             self._states[channel] = value
+            self._inputs[channel] = value
 
     def get_values(self, channel_names):
         channel_outputs = {}
@@ -66,47 +156,436 @@ class SimFrameInterface(interface.Interface):
 
         return channel_outputs
 
-    def track(self):
-        with TemporaryDirectory(dir=self.base_dir) as tmpdir:
-            _framework = Framework.Framework(directory=self.base_dir, verbose=False)
-            _framework.loadSettings(self.settings_file)
-            _framework.setSubDirectory(tmpdir)
-            _framework.change_Lattice_Code(
-                "All", "elegant", exclude=["generator", "injector400"]
+    def get_framework(self):
+        """Load the lattice once and reuse it until the settings change."""
+        key = (
+            self.base_dir,
+            self.settings_file,
+            self.start_lattice,
+            self.end_lattice,
+            settings_fingerprint(self.settings_file, self.base_dir),
+        )
+        if self._framework is None or self._framework_key != key:
+            # SimulationFramework is only imported once a lattice is needed
+            from SimulationFramework import Framework
+
+            with timer.phase("lattice"):
+                _framework = Framework.Framework(directory=self.base_dir, verbose=False)
+                _framework.loadSettings(self.settings_file)
+                _framework.change_Lattice_Code(
+                    "All", "elegant", exclude=["generator", "injector400"]
+                )
+            self._framework = _framework
+            self._framework_key = key
+            self._framework_defaults = {}
+        return self._framework
+
+    def _get_parameter(self, _framework, name, param):
+        if name == "generator":
+            return getattr(_framework.generator, param)
+        elif name in _framework.elements:
+            return _framework.getElement(name, param)
+        elif name in _framework.groups:
+            return getattr(_framework[name], param)
+        raise KeyError(name)
+
+    def _set_parameter(self, _framework, name, param, val):
+        if name == "generator":
+            setattr(_framework.generator, param, val)
+        elif name in _framework.elements:
+            _framework.modifyElement(name, param, val)
+        elif name in _framework.groups:
+            _framework[name].change_Parameter(param, val)
+
+    def _apply_inputs(self, _framework):
+        # Put back anything a previous evaluation changed that is no longer an input,
+        # so the reused lattice always matches a freshly loaded one plus the inputs.
+        for elem in list(self._framework_defaults):
+            if elem not in self._inputs:
+                name, param = elem.split(":")
+                self._set_parameter(
+                    _framework, name, param, self._framework_defaults.pop(elem)
+                )
+        for elem, val in self._inputs.items():
+            if ":" not in elem:
+                continue
+            name, param = elem.split(":")
+            if elem not in self._framework_defaults:
+                try:
+                    self._framework_defaults[elem] = self._get_parameter(
+                        _framework, name, param
+                    )
+                except KeyError:
+                    continue
+            self._set_parameter(_framework, name, param, val)
+
+    def fidelity_level(self, inputs: dict | None = None) -> int | None:
+        """Index into ``fidelity_sampling`` selected by the ``fidelity`` input in [0, 1]."""
+        inputs = self._inputs if inputs is None else inputs
+        if not self.fidelity_sampling or "fidelity" not in inputs:
+            return None
+        levels = len(self.fidelity_sampling)
+        return min(max(round(float(inputs["fidelity"]) * (levels - 1)), 0), levels - 1)
+
+    def effective_sampling(self, inputs: dict | None = None) -> int:
+        level = self.fidelity_level(inputs)
+        return self.sampling if level is None else self.fidelity_sampling[level]
+
+    def lattice_range(self, _framework) -> list[str]:
+        _startfile = (
+            self.start_lattice
+            if self.start_lattice is not None
+            else _framework.lines[0]
+        )
+        _endfile = (
+            self.end_lattice if self.end_lattice is not None else _framework.lines[-1]
+        )
+        lines = list(_framework.lines)
+        return lines[lines.index(_startfile) : lines.index(_endfile) + 1]
+
+    def section_index(self, _framework, lines: list[str], channel: str) -> int:
+        """Index of the first lattice in ``lines`` affected by changing ``channel``."""
+        name = channel.split(":")[0]
+        if name in _framework.groups and name not in _framework.elements:
+            members = getattr(_framework[name], "elements", [])
+        else:
+            members = [name]
+        for index, line in enumerate(lines):
+            lattice = _framework[line]
+            if name in getattr(lattice, "groups", {}):
+                return index
+            if any(member in getattr(lattice, "elements", {}) for member in members):
+                return index
+        # Unknown or generator parameters change the whole run
+        return 0
+
+    def get_checkpoints(self) -> CheckpointStore:
+        if self._checkpoints is None:
+            self._checkpoint_dir = TemporaryDirectory(dir=self.working_dir)
+            self._checkpoints = CheckpointStore(
+                self._checkpoint_dir.name, max_configs=self.checkpoints
             )
-            _startfile = (
-                self.start_lattice
-                if self.start_lattice is not None
-                else _framework.lines[0]
+        return self._checkpoints
+
+    def _track_sections(self, _framework, tmpdir, lines: list[str]):
+        store = self.get_checkpoints()
+        sections = {
+            channel: self.section_index(_framework, lines, channel)
+            for channel in self._inputs
+        }
+        keys = [
+            self.cache_key(
+                {ch: val for ch, val in self._inputs.items() if sections[ch] < index}
             )
-            _endfile = (
-                self.end_lattice if self.end_lattice is not None else _framework.lines[-1]
+            for index in range(len(lines))
+        ]
+        start = 0
+        for index in range(len(lines) - 1, 0, -1):
+            checkpoint = store.get(lines[index], keys[index])
+            if checkpoint is not None:
+                store.restore(checkpoint, tmpdir)
+                start = index
+                break
+
+        lattice = _framework[lines[start]]
+        original = (lattice.prefix, lattice.sample_interval)
+        if start > 0:
+            # The checkpointed beam has already been sub-sampled
+            lattice.prefix = tmpdir
+            lattice.sample_interval = 1
+        try:
+            for index in range(start, len(lines)):
+                _framework.track(startfile=lines[index], endfile=lines[index])
+                if index + 1 < len(lines):
+                    store.save(lines[index + 1], keys[index + 1], tmpdir)
+        finally:
+            if start > 0:
+                lattice.prefix, lattice.sample_interval = original
+
+    def beam_requests(self, observable_names: list[str]) -> dict:
+        """Group requested ``screen:parameter`` observables by screen."""
+        requests = {}
+        for name in observable_names:
+            if ":" not in name:
+                continue
+            scr, param = name.rsplit(":", 1)
+            if param in beam_evaluate:
+                requests.setdefault(scr, []).append(param)
+        return requests
+
+    def beam_outputs(self, scr: str, beam, params) -> dict:
+        if self.fast_statistics:
+            values = beam_statistics(beam, params)
+        else:
+            values = {param: float(getattr(beam, param)) for param in params}
+        return {f"{scr}:{param}": value for param, value in values.items()}
+
+    def beam_file(self, tmpdir, scr: str) -> str | None:
+        filenames = glob.glob(os.path.join(tmpdir, glob.escape(scr) + ".*hdf5"))
+        return filenames[0] if filenames else None
+
+    def _load_requested_beams(self, tmpdir, observable_names: list[str]) -> dict:
+        from SimulationFramework.Modules import Beams as rbf
+
+        outputs = {}
+        for scr, params in self.beam_requests(observable_names).items():
+            filename = self.beam_file(tmpdir, scr)
+            if filename is None:
+                continue
+            beam = rbf.beam()
+            beam.read_HDF5_beam_file(filename)
+            outputs.update(self.beam_outputs(scr, beam, params))
+        return outputs
+
+    def _load_all_beams(self, tmpdir, _framework) -> dict:
+        from SimulationFramework import Framework
+
+        fwdir = Framework.load_directory(tmpdir, beams=True, framework=_framework)
+        outputs = {}
+        for index in range(len(fwdir.beams)):
+            beam = fwdir.beams[index]
+            scr = re.split(r" |/|\\", beam["filename"])[-1].split(".")[0]
+            outputs.update(self.beam_outputs(scr, beam, beam_evaluate))
+        return outputs
+
+    @property
+    def working_dir(self) -> str:
+        if self.scratch_dir is None:
+            return self.base_dir
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        return self.scratch_dir
+
+    def archive(self, inputs: dict, outputs: dict, tmpdir=None, observable_names=None):
+        if self.archive_file is None:
+            return
+        beams = {}
+        if tmpdir is not None:
+            screens = self.archive_screens or list(self.beam_requests(observable_names or []))
+            for scr in screens:
+                filename = self.beam_file(tmpdir, scr)
+                if filename is not None:
+                    beams[scr] = filename
+        from .archive import RunArchive
+
+        RunArchive(self.archive_file).append(inputs, outputs, beams)
+
+    def track(self, observable_names: list[str] | None = None):
+        with TemporaryDirectory(dir=self.working_dir) as tmpdir:
+            _framework = self.get_framework()
+            _framework.setSubDirectory(tmpdir)
+            lines = self.lattice_range(_framework)
+            _framework[lines[0]].sample_interval = 2 ** (3 * self.effective_sampling())
+            _framework[lines[0]].prefix = self.prefix
+
+            self._apply_inputs(_framework)
+            with timer.phase("track"):
+                if self.checkpoints > 0 and len(lines) > 1:
+                    self._track_sections(_framework, tmpdir, lines)
+                else:
+                    _framework.track(startfile=lines[0], endfile=lines[-1])
+
+            with timer.phase("beams"):
+                if self.lazy_beams and observable_names is not None:
+                    outputs = self._load_requested_beams(tmpdir, observable_names)
+                else:
+                    outputs = self._load_all_beams(tmpdir, _framework)
+            level = self.fidelity_level()
+            if level is not None:
+                outputs["fidelity"] = level / max(len(self.fidelity_sampling) - 1, 1)
+            with timer.phase("archive"):
+                self.archive(self._inputs, outputs, tmpdir, observable_names)
+            self._states.update(outputs)
+            return outputs
+
+    def cache_key(self, inputs: dict | None = None):
+        inputs = self._inputs if inputs is None else inputs
+        return cache_key(
+            {channel: val for channel, val in inputs.items() if channel != "fidelity"},
+            base_dir=self.base_dir,
+            settings_file=self.settings_file,
+            settings_files=settings_fingerprint(self.settings_file, self.base_dir),
+            start_lattice=self.start_lattice,
+            end_lattice=self.end_lattice,
+            sampling=self.effective_sampling(inputs),
+            prefix=self.prefix,
+            fast_statistics=self.fast_statistics,
+        )
+
+    def _cached(self, key: str, observable_names: list[str]) -> dict | None:
+        outputs = self._cache.get(key)
+        if outputs is None:
+            return None
+        for scr, params in self.beam_requests(observable_names).items():
+            if any(f"{scr}:{param}" not in outputs for param in params):
+                return None
+        return outputs
+
+    def get_supervisor(self) -> TrackingSupervisor:
+        if self._supervisor is None:
+            self._supervisor = TrackingSupervisor(
+                _track_in_worker, max_workers=max(1, self.workers)
             )
-            _framework[_startfile].sample_interval = 2 ** (3 * self.sampling)
-            _framework[_startfile].prefix = self.prefix
+            kill_on_terminate(self._supervisor)
+        return self._supervisor
 
-            for elem, val in self._states.items():
-                name, param = elem.split(":")
-                if name == "generator":
-                    setattr(_framework.generator, param, val)
-                elif name in _framework.elements:
-                    _framework.modifyElement(name, param, val)
-                elif name in _framework.groups:
-                    _framework[name].change_Parameter(param, val)
-            _framework.track(startfile=_startfile, endfile=_endfile)
-
-            fwdir = Framework.load_directory(tmpdir, beams=True, framework=_framework)
-            for index in range(len(fwdir.beams)):
-                beam = fwdir.beams[index]
-                scr = re.split(r" |/|\\", beam["filename"])[-1].split(".")[0]
-                for param in beam_evaluate:
-                    self._states.update({f"{scr}:{param}": float(getattr(beam, param))})
-            return self._states
+    def track_async(
+        self,
+        observable_names: list[str] | None = None,
+        channel_inputs: dict | None = None,
+    ) -> Future:
+        """Track in a supervised child process; the future resolves to a TrackResult."""
+        return self.get_supervisor().submit(
+            self.worker_config(),
+            self._inputs | (channel_inputs or {}),
+            observable_names,
+            timeout=self.timeout,
+        )
 
-    def get_observables(self, observable_names: list[str]) -> dict:
-        self.track()
+    def cancel(self):
+        """Stop any supervised tracking that is queued or running.
+
+        Stopping the routine in Badger terminates its process, which kills
+        supervised tracking through the handler set by ``kill_on_terminate``.
+        """
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+
+    def failed_outputs(self, observable_names: list[str]) -> dict:
         return {
+            f"{scr}:{param}": float("nan")
+            for scr, params in self.beam_requests(observable_names).items()
+            for param in params
+        }
+
+    def _result_outputs(self, result, inputs: dict, observable_names: list[str], key):
+        if isinstance(result, TrackResult):
+            self._last_result = result
+            if not result.ok:
+                logger.warning("SimFrame tracking failed: %s", result)
+                return self.failed_outputs(observable_names)
+            result = result.outputs
+        self.archive(inputs, result)
+        self._cache.put(key, (self._cache.get(key) or {}) | result)
+        return result
+
+    def get_observables(self, observable_names: list[str]) -> dict:
+        timer.start(self, observable_names)
+        key = self.cache_key()
+        outputs = self._cached(key, observable_names)
+        if outputs is None and self.supervised:
+            with timer.phase("track"):
+                result = self.track_async(observable_names).result()
+            outputs = self._result_outputs(
+                result,
+                self._inputs,
+                observable_names,
+                key,
+            )
+            self._states.update(outputs)
+        elif outputs is None:
+            outputs = self.track(observable_names)
+            self._cache.put(key, (self._cache.get(key) or {}) | outputs)
+        else:
+            self._states.update(outputs)
+        outputs = {
             name: self._states[name]
             for name in observable_names
             if name in self._states
         }
+        outputs.update(timer.observables(observable_names))
+        timer.log(interface=self.name, observables=observable_names, key=key)
+        timer.reset()
+        return outputs
+
+    def worker_config(self) -> dict:
+        """Settings needed to rebuild this interface in a worker process."""
+        # Workers never write to the archive; results are appended here instead
+        return self.model_dump(
+            exclude={"cache_size", "cache_dir", "workers", "archive_file"}
+        ) | {
+            "cache_size": 0,
+            "workers": 1,
+        }
+
+    def _get_pool(self, workers: int):
+        if self._pool is None or self._pool_workers != workers:
+            self.close()
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            self._pool_workers = workers
+        return self._pool
+
+    def evaluate_batch(
+        self,
+        channel_inputs_list: list[dict],
+        observable_names: list[str],
+        workers: int | None = None,
+    ) -> list[dict]:
+        """Track each set of inputs in its own worker process, returning observables in order.
+
+        Channels missing from an entry take their current value on this interface.
+        """
+        workers = self.workers if workers is None else workers
+        config = self.worker_config()
+        keys = []
+        results = {}
+        futures = {}
+        submitted = {}
+        for channel_inputs in channel_inputs_list:
+            inputs = self._inputs | channel_inputs
+            key = self.cache_key(inputs)
+            keys.append(key)
+            if key in results or key in futures:
+                continue
+            outputs = self._cached(key, observable_names)
+            if outputs is not None:
+                results[key] = outputs
+            elif self.supervised:
+                futures[key] = self.get_supervisor().submit(
+                    config, inputs, observable_names, timeout=self.timeout
+                )
+                submitted[key] = inputs
+            else:
+                futures[key] = self._get_pool(max(1, workers)).submit(
+                    _track_in_worker, config, inputs, observable_names
+                )
+                submitted[key] = inputs
+        for key, future in futures.items():
+            results[key] = self._result_outputs(
+                future.result(), submitted[key], observable_names, key
+            )
+        return [
+            {name: results[key][name] for name in observable_names if name in results[key]}
+            for key in keys
+        ]
+
+    def close(self):
+        if self._supervisor is not None:
+            self._supervisor.shutdown()
+            self._supervisor = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._checkpoints is not None:
+            self._checkpoints.clear()
+            self._checkpoint_dir.cleanup()
+            self._checkpoints = None
+            self._checkpoint_dir = None
+
+
+# One interface per worker process, so repeated batches reuse the loaded lattice.
+_worker_interfaces = {}
+
+
+def _track_in_worker(
+    config: dict, channel_inputs: dict, observable_names: list[str] | None = None
+) -> dict:
+    key = repr(sorted(config.items()))
+    simframe = _worker_interfaces.get(key)
+    if simframe is None:
+        _worker_interfaces.clear()
+        simframe = _worker_interfaces[key] = SimFrameInterface(**config)
+    simframe._inputs.clear()
+    simframe.set_values(channel_inputs)
+    return simframe.track(observable_names)
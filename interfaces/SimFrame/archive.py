@@ -0,0 +1,45 @@
+import os
+import time
+import h5py
+
+
+class RunArchive:
+    """Append-only HDF5 record of tracking results for one optimisation run.
+
+    Each evaluation becomes a numbered group holding the inputs and statistics as
+    attributes and, optionally, compressed copies of selected beam files.
+    """
+
+    def __init__(self, filename: str | os.PathLike, compression: str = "gzip"):
+        self.filename = filename
+        self.compression = compression
+
+    def _copy_beam(self, filename: str, group):
+        with h5py.File(filename, "r") as src:
+
+            def copy(name, obj):
+                if isinstance(obj, h5py.Dataset):
+                    data = obj[()]
+                    if obj.shape:
+                        dset = group.create_dataset(
+                            name, data=data, compression=self.compression, shuffle=True
+                        )
+                    else:
+                        dset = group.create_dataset(name, data=data)
+                    dset.attrs.update(obj.attrs)
+                elif isinstance(obj, h5py.Group):
+                    group.require_group(name).attrs.update(obj.attrs)
+
+            group.attrs.update(src.attrs)
+            src.visititems(copy)
+
+    def append(self, inputs: dict, outputs: dict, beams: dict | None = None):
+        with h5py.File(self.filename, "a") as f:
+            group = f.create_group(f"evaluation_{len(f):06d}")
+            group.attrs["time"] = time.time()
+            group.create_group("inputs").attrs.update(
+                {channel: value for channel, value in inputs.items()}
+            )
+            group.create_group("statistics").attrs.update(outputs)
+            for scr, filename in (beams or {}).items():
+                self._copy_beam(filename, group.create_group(f"beams/{scr}"))
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Electron rest energy in eV, matching the eV/c momenta stored in SimFrame beams
+electron_rest_energy = 510998.95
+
+_columns = ("x", "y", "z", "t", "cp", "energy", "bgx", "bgy", "xp", "yp")
+_index = {name: index for index, name in enumerate(_columns)}
+
+
+def _coordinates(beam):
+    cpx = np.asarray(beam.cpx, dtype=float)
+    cpy = np.asarray(beam.cpy, dtype=float)
+    cpz = np.asarray(beam.cpz, dtype=float)
+    cp = np.sqrt(cpx**2 + cpy**2 + cpz**2)
+    return np.vstack(
+        (
+            np.asarray(beam.x, dtype=float),
+            np.asarray(beam.y, dtype=float),
+            np.asarray(beam.z, dtype=float),
+            np.asarray(beam.t, dtype=float),
+            cp,
+            np.sqrt(cp**2 + electron_rest_energy**2),
+            cpx / electron_rest_energy,
+            cpy / electron_rest_energy,
+            cpx / cpz,
+            cpy / cpz,
+        )
+    )
+
+
+def _weights(beam, n: int):
+    charge = getattr(beam, "charge", None)
+    if charge is not None:
+        charge = np.abs(np.asarray(charge, dtype=float))
+        if charge.shape == (n,) and charge.sum() > 0:
+            return charge
+    return np.ones(n)
+
+
+def _emittance(cov, u: str, v: str):
+    i, j = _index[u], _index[v]
+    return np.sqrt(max(cov[i, i] * cov[j, j] - cov[i, j] ** 2, 0.0))
+
+
+def beam_statistics(beam, params=None) -> dict:
+    """Compute the requested beam statistics from one pass over the particle arrays.
+
+    Means and the full second-moment matrix of the phase-space coordinates are
+    formed once (weighted by macro-particle charge where available) and every
+    statistic is derived from them. Parameters not covered here, including
+    ``linear_chirp_z`` and ``peak_current`` whose SimFrame definitions depend
+    on its slicing, fall back to ``getattr(beam, param)``.
+    """
+    data = _coordinates(beam)
+    weights = _weights(beam, data.shape[1])
+    total = weights.sum()
+    mean = data @ weights / total
+    centred = data - mean[:, None]
+    cov = (centred * weights) @ centred.T / total
+
+    def sigma(name):
+        return np.sqrt(cov[_index[name], _index[name]])
+
+    mean_cp = mean[_index["cp"]]
+    stats = {
+        "sigma_x": lambda: sigma("x"),
+        "sigma_y": lambda: sigma("y"),
+        "sigma_z": lambda: sigma("z"),
+        "sigma_t": lambda: sigma("t"),
+        "sigma_cp": lambda: sigma("cp"),
+        "mean_cp": lambda: mean_cp,
+        "mean_energy": lambda: mean[_index["energy"]],
+        "momentum_spread": lambda: sigma("cp") / mean_cp,
+        "enx": lambda: _emittance(cov, "x", "bgx"),
+        "eny": lambda: _emittance(cov, "y", "bgy"),
+        "beta_x": lambda: cov[_index["x"], _index["x"]] / _emittance(cov, "x", "xp"),
+        "beta_y": lambda: cov[_index["y"], _index["y"]] / _emittance(cov, "y", "yp"),
+        "alpha_x": lambda: -cov[_index["x"], _index["xp"]] / _emittance(cov, "x", "xp"),
+        "alpha_y": lambda: -cov[_index["y"], _index["yp"]] / _emittance(cov, "y", "yp"),
+    }
+    outputs = {}
+    for param in stats if params is None else params:
+        if param in stats:
+            outputs[param] = float(stats[param]())
+        else:
+            outputs[param] = float(getattr(beam, param))
+    return outputs
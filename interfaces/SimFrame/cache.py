@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+
+# Settings files are scanned for other settings or lattice files they include
+_settings_suffixes = (".def", ".yaml", ".yml")
+_path_token = re.compile(r"[^\s'\"=,;\[\]{}()#]+")
+_scans = {}
+
+
+def _normalise(value):
+    try:
+        return float(f"{float(value):.12g}")
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def cache_key(inputs: dict, **settings) -> str:
+    """Hash the input channels and tracking settings into a stable cache key."""
+    payload = {
+        "inputs": {channel: _normalise(value) for channel, value in inputs.items()},
+        "settings": {name: str(value) for name, value in settings.items()},
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _stat(path: str) -> tuple | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _resolve(name: str, roots: list[str]) -> str | None:
+    for root in roots:
+        path = os.path.abspath(os.path.join(root, name))
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _scan(settings_file: str, base_dir: str) -> dict[str, tuple | None]:
+    """Stat every file reachable from ``settings_file`` through the names it mentions."""
+    files = {}
+    pending = [(settings_file, [os.getcwd(), base_dir])]
+    while pending:
+        name, roots = pending.pop()
+        path = _resolve(name, roots)
+        if path is None or path in files:
+            continue
+        files[path] = _stat(path)
+        if not path.lower().endswith(_settings_suffixes):
+            continue
+        try:
+            with open(path, "r", errors="ignore") as f:
+                text = f.read()
+        except OSError:
+            continue
+        roots = [os.path.dirname(path), base_dir]
+        pending.extend((token, roots) for token in _path_token.findall(text) if "." in token)
+    return files
+
+
+def settings_fingerprint(settings_file: str | os.PathLike, base_dir: str | os.PathLike) -> str:
+    """Hash of the modification time and size of a settings file and the files it includes.
+
+    The included files are found again only when one of the scanned files changed.
+    """
+    settings_file, base_dir = os.fspath(settings_file), os.fspath(base_dir)
+    files = _scans.get((settings_file, base_dir))
+    if not files or any(_stat(path) != stat for path, stat in files.items()):
+        files = _scans[(settings_file, base_dir)] = _scan(settings_file, base_dir)
+    return hashlib.sha256(json.dumps(sorted(files.items())).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU of tracking results, optionally backed by a size-limited directory."""
+
+    def __init__(
+        self,
+        max_entries: int = 128,
+        directory: str | os.PathLike | None = None,
+        max_bytes: int = 2**30,
+    ):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + ".json")
+
+    def _remember(self, key: str, outputs: dict):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = outputs
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> dict | None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return dict(self._memory[key])
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, "r") as f:
+                    outputs = json.load(f)
+            except (OSError, ValueError):
+                return None
+            os.utime(path)
+            self._remember(key, outputs)
+            return dict(outputs)
+        return None
+
+    def put(self, key: str, outputs: dict):
+        outputs = dict(outputs)
+        self._remember(key, outputs)
+        if self.directory is not None:
+            path = self._path(key)
+            with open(path + ".tmp", "w") as f:
+                json.dump(outputs, f)
+            os.replace(path + ".tmp", path)
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        self._memory.clear()
+        if self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    os.remove(entry.path)
@@ -0,0 +1,75 @@
+import os
+import glob
+import shutil
+from collections import OrderedDict
+from tempfile import mkdtemp
+
+
+class CheckpointStore:
+    """Beam files saved at lattice boundaries, keyed on the upstream configuration.
+
+    Only the last ``max_configs`` configurations are kept for each boundary.
+    Beam files are copied out of the tracking directory, so nothing tracking
+    writes later can reach a checkpoint. A file already copied into an earlier
+    checkpoint unchanged (same name, size and mtime) is hard-linked from there,
+    so the screens upstream of every boundary are stored once rather than once
+    per boundary. Restores copy.
+    """
+
+    def __init__(self, directory: str | os.PathLike, max_configs: int = 4):
+        self.directory = directory
+        self.max_configs = max_configs
+        self._boundaries = {}
+        self._files = {}
+
+    def get(self, boundary: str, key: str) -> str | None:
+        entries = self._boundaries.get(boundary)
+        if entries is None or key not in entries:
+            return None
+        entries.move_to_end(key)
+        return entries[key]
+
+    def save(self, boundary: str, key: str, source_dir: str | os.PathLike):
+        entries = self._boundaries.setdefault(boundary, OrderedDict())
+        if key in entries:
+            entries.move_to_end(key)
+            return
+        checkpoint = mkdtemp(dir=self.directory)
+        for filename in glob.glob(os.path.join(source_dir, "*.hdf5")):
+            self._store(filename, checkpoint)
+        entries[key] = checkpoint
+        while len(entries) > self.max_configs:
+            _, old = entries.popitem(last=False)
+            self._remove(old)
+
+    def _store(self, filename: str, checkpoint: str):
+        stat = os.stat(filename)
+        identity = (os.path.basename(filename), stat.st_size, stat.st_mtime_ns)
+        target = os.path.join(checkpoint, identity[0])
+        saved = self._files.get(identity)
+        if saved is not None:
+            try:
+                os.link(saved, target)
+                return
+            except OSError:
+                pass
+        shutil.copy2(filename, target)
+        self._files[identity] = target
+
+    def _remove(self, checkpoint: str):
+        shutil.rmtree(checkpoint, ignore_errors=True)
+        prefix = os.path.join(checkpoint, "")
+        self._files = {
+            identity: path for identity, path in self._files.items() if not path.startswith(prefix)
+        }
+
+    def restore(self, checkpoint: str, target_dir: str | os.PathLike):
+        for filename in glob.glob(os.path.join(checkpoint, "*.hdf5")):
+            shutil.copy2(filename, target_dir)
+
+    def clear(self):
+        for entries in self._boundaries.values():
+            for checkpoint in entries.values():
+                shutil.rmtree(checkpoint, ignore_errors=True)
+        self._boundaries.clear()
+        self._files.clear()
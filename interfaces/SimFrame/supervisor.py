@@ -0,0 +1,232 @@
+import os
+import time
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class TrackResult:
+    """Outcome of one supervised tracking run.
+
+    ``status`` is one of ``"ok"``, ``"timeout"``, ``"cancelled"`` or ``"error"``.
+    """
+
+    def __init__(
+        self,
+        status: str,
+        outputs: dict | None = None,
+        elapsed: float = 0.0,
+        error: str | None = None,
+    ):
+        self.status = status
+        self.outputs = outputs or {}
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+    def __repr__(self):
+        return (
+            f"TrackResult(status={self.status!r}, elapsed={self.elapsed:.3f}, "
+            f"error={self.error!r})"
+        )
+
+
+def _watch_parent(parent: int, interval: float):
+    # The worker has its own process group, so it is not killed along with its parent
+    while os.getppid() == parent:
+        time.sleep(interval)
+    os.killpg(os.getpid(), signal.SIGKILL)
+
+
+def _terminate_group(signum, frame):
+    signal.signal(signum, signal.SIG_DFL)
+    os.killpg(os.getpid(), signum)
+
+
+def _serve(connection, parent: int, interval: float):
+    # Own process group, so the tracking code and anything it spawned can be killed together
+    if hasattr(os, "setsid"):
+        os.setsid()
+        # Also when only the worker is terminated, e.g. by multiprocessing at exit
+        signal.signal(signal.SIGTERM, _terminate_group)
+        threading.Thread(target=_watch_parent, args=(parent, interval), daemon=True).start()
+    while True:
+        try:
+            target, args = connection.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            reply = ("ok", target(*args), None)
+        except Exception as e:
+            reply = ("error", None, repr(e))
+        connection.send(reply)
+
+
+def _terminate(process, grace: float = 5.0):
+    if not process.is_alive():
+        process.join()
+        return
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    else:
+        process.terminate()
+    process.join(grace)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+class _Worker:
+    """A long-lived child process running one call at a time."""
+
+    def __init__(self, context, poll_interval: float):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_serve, args=(child, os.getpid(), poll_interval), daemon=True
+        )
+        self.process.start()
+        child.close()
+
+    def close(self, grace: float = 5.0):
+        # An idle worker exits when its pipe closes
+        self.connection.close()
+        self.process.join(grace)
+        _terminate(self.process)
+
+
+class TrackingSupervisor:
+    """Run ``target(*args)`` in child processes with a wall-clock timeout and cancellation.
+
+    Workers are kept between runs, so whatever ``target`` caches in the child
+    (such as a loaded Framework) is reused. A worker is only replaced after it
+    timed out, was cancelled or died. Workers watch for this process exiting
+    and then kill their process group, so tracking never outlives the routine.
+    """
+
+    def __init__(self, target, max_workers: int = 1, poll_interval: float = 0.2):
+        self.target = target
+        self.poll_interval = poll_interval
+        self._context = multiprocessing.get_context("spawn")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._active = set()
+        self._idle = []
+        self._workers = set()
+
+    def submit(self, *args, timeout: float | None = None) -> Future:
+        """Start a run and return a future resolving to a :class:`TrackResult`."""
+        stop = threading.Event()
+        with self._lock:
+            self._active.add(stop)
+        return self._executor.submit(self._supervise, args, timeout, stop)
+
+    def _worker(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.close()
+                self._workers.discard(worker)
+            worker = _Worker(self._context, self.poll_interval)
+            self._workers.add(worker)
+            return worker
+
+    def _supervise(self, args, timeout, stop) -> TrackResult:
+        start = time.monotonic()
+        try:
+            if stop.is_set():
+                return TrackResult("cancelled")
+            worker = self._worker()
+            status, outputs, error = "error", None, None
+            reusable = False
+            try:
+                worker.connection.send((self.target, args))
+                while True:
+                    if worker.connection.poll(self.poll_interval):
+                        status, outputs, error = worker.connection.recv()
+                        reusable = True
+                        break
+                    if not worker.process.is_alive() and not worker.connection.poll(0):
+                        break
+                    if stop.is_set():
+                        status = "cancelled"
+                        break
+                    if timeout is not None and time.monotonic() - start > timeout:
+                        status = "timeout"
+                        break
+            except (EOFError, OSError):
+                # The worker died
+                pass
+            finally:
+                if reusable:
+                    with self._lock:
+                        self._idle.append(worker)
+                else:
+                    worker.connection.close()
+                    _terminate(worker.process)
+                    with self._lock:
+                        self._workers.discard(worker)
+            if status == "error" and error is None:
+                error = f"worker exited with code {worker.process.exitcode}"
+            return TrackResult(status, outputs, time.monotonic() - start, error)
+        finally:
+            with self._lock:
+                self._active.discard(stop)
+
+    def cancel(self):
+        """Stop every run that is queued or in progress."""
+        with self._lock:
+            for stop in self._active:
+                stop.set()
+
+    def kill(self):
+        """Kill every worker and what it spawned straight away, e.g. as this process is stopped."""
+        self.cancel()
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            if hasattr(os, "killpg"):
+                try:
+                    os.killpg(worker.process.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    pass
+            else:
+                worker.process.kill()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._workers.clear()
+        for worker in idle:
+            worker.close()
+
+
+def kill_on_terminate(supervisor: TrackingSupervisor):
+    """Kill the supervisor's workers when this process receives SIGTERM.
+
+    Badger stops a routine by terminating its process, so this is what cancels
+    a run in progress from Badger. Only possible from the main thread.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        supervisor.kill()
+        signal.signal(signum, previous)
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, handler)
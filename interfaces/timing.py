@@ -0,0 +1,91 @@
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Phase:
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_phase = _NoPhase()
+
+
+class PhaseTimer:
+    """Wall time spent in each named phase of the current evaluation.
+
+    Times for a phase entered several times, or from several threads, are
+    summed. While disabled, :meth:`phase` returns a shared no-op context.
+    """
+
+    def __init__(self, enabled: bool = False, log_file: str | None = None):
+        self.enabled = enabled
+        self.log_file = log_file
+        self.times = {}
+        self._lock = threading.Lock()
+
+    def start(self, interface, observable_names=()):
+        """Apply an interface's ``timing`` and ``timing_log`` settings before it reads or writes.
+
+        Asking for a ``timing:`` observable switches timing on for the interface from then on.
+        """
+        if any(name.startswith("timing:") for name in observable_names):
+            interface.timing = True
+        self.enabled = interface.timing or interface.timing_log is not None
+        self.log_file = interface.timing_log
+
+    def phase(self, name: str):
+        return _Phase(self, name) if self.enabled else _no_phase
+
+    def add(self, name: str, elapsed: float):
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.0) + elapsed
+
+    def reset(self):
+        with self._lock:
+            self.times = {}
+
+    def observables(self, observable_names: list[str]) -> dict:
+        """Values for the ``timing:<phase>`` names in ``observable_names``."""
+        return {
+            name: self.times.get(name.split(":", 1)[1], 0.0)
+            for name in observable_names
+            if name.startswith("timing:")
+        }
+
+    def log(self, **context):
+        """Write this evaluation's times as one JSON line to ``log_file`` and the debug log."""
+        if not self.enabled:
+            return
+        record = {"time": time.time(), "phases": dict(self.times), **context}
+        logger.debug("phase times %s", record["phases"])
+        if self.log_file is not None:
+            with open(self.log_file, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+
+timer = PhaseTimer()
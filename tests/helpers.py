@@ -0,0 +1,14 @@
+import os
+import sys
+import importlib.util
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name: str, *path: str):
+    """Import one plugin module by file, without running its package ``__init__``."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(root, *path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,119 @@
+"""Write the fixture beam and its reference statistics used by test_beam_statistics.
+
+The beam is stored in SimFrame's HDF5 layout (``beam/beam`` holding x, y, z, cpx,
+cpy, cpz, t and charge columns). With SimulationFramework installed the reference
+values are SimFrame's own beam attributes; without it they come from the
+per-attribute definitions below, and ``source`` in the JSON file says which.
+
+    python tests/make_beam_reference.py
+"""
+
+import os
+import json
+import h5py
+import numpy as np
+
+data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+beam_file = os.path.join(data, "beam.hdf5")
+reference_file = os.path.join(data, "beam_reference.json")
+
+# Electron rest energy in eV
+me = 510998.95
+
+params = (
+    "sigma_x",
+    "sigma_y",
+    "sigma_z",
+    "sigma_t",
+    "sigma_cp",
+    "mean_cp",
+    "mean_energy",
+    "momentum_spread",
+    "enx",
+    "eny",
+    "beta_x",
+    "beta_y",
+    "alpha_x",
+    "alpha_y",
+)
+
+
+def make_beam(n=1000, seed=0) -> np.ndarray:
+    """(n, 8) particle array, a correlated Gaussian bunch of about 35 MeV/c and 250 pC."""
+    rng = np.random.default_rng(seed)
+    x = rng.normal(1e-4, 1e-3, n)
+    cpx = 2e3 * x / 1e-3 + rng.normal(0, 1e3, n)
+    y = rng.normal(0, 5e-4, n)
+    cpy = rng.normal(0, 5e2, n) - 1e3 * y / 5e-4
+    z = rng.normal(0, 1e-3, n)
+    cpz = rng.normal(35e6, 1e4, n) + 2e9 * z
+    t = -z / 299792458.0
+    charge = rng.uniform(0.5, 1.5, n) * 250e-12 / n
+    return np.column_stack((x, y, z, cpx, cpy, cpz, t, charge))
+
+
+def reference(beam, param):
+    """One statistic on its own from the particle arrays, charge weighted."""
+    w = beam.charge
+
+    def mean(a):
+        return np.average(a, weights=w)
+
+    def cov(a, b):
+        return mean((a - mean(a)) * (b - mean(b)))
+
+    def emittance(a, b):
+        return np.sqrt(cov(a, a) * cov(b, b) - cov(a, b) ** 2)
+
+    cp = np.sqrt(beam.cpx**2 + beam.cpy**2 + beam.cpz**2)
+    xp, yp = beam.cpx / beam.cpz, beam.cpy / beam.cpz
+    return {
+        "sigma_x": lambda: np.sqrt(cov(beam.x, beam.x)),
+        "sigma_y": lambda: np.sqrt(cov(beam.y, beam.y)),
+        "sigma_z": lambda: np.sqrt(cov(beam.z, beam.z)),
+        "sigma_t": lambda: np.sqrt(cov(beam.t, beam.t)),
+        "sigma_cp": lambda: np.sqrt(cov(cp, cp)),
+        "mean_cp": lambda: mean(cp),
+        "mean_energy": lambda: mean(np.sqrt(cp**2 + me**2)),
+        "momentum_spread": lambda: np.sqrt(cov(cp, cp)) / mean(cp),
+        "enx": lambda: emittance(beam.x, beam.cpx / me),
+        "eny": lambda: emittance(beam.y, beam.cpy / me),
+        "beta_x": lambda: cov(beam.x, beam.x) / emittance(beam.x, xp),
+        "beta_y": lambda: cov(beam.y, beam.y) / emittance(beam.y, yp),
+        "alpha_x": lambda: -cov(beam.x, xp) / emittance(beam.x, xp),
+        "alpha_y": lambda: -cov(beam.y, yp) / emittance(beam.y, yp),
+    }[param]()
+
+
+def read_beam(filename=beam_file):
+    """The particle columns of a SimFrame HDF5 beam file as attributes."""
+    from types import SimpleNamespace
+
+    with h5py.File(filename, "r") as f:
+        x, y, z, cpx, cpy, cpz, t, charge = np.array(f["beam/beam"]).T
+    return SimpleNamespace(x=x, y=y, z=z, t=t, cpx=cpx, cpy=cpy, cpz=cpz, charge=charge, Q=charge.sum())
+
+
+def main():
+    os.makedirs(data, exist_ok=True)
+    with h5py.File(beam_file, "w") as f:
+        f["beam/beam"] = make_beam()
+        f["beam/reference_particle"] = np.zeros(8)
+        f["beam/longitudinal_reference"] = "t"
+    try:
+        from SimulationFramework.Modules import Beams
+    except ImportError:
+        beam, source = read_beam(), "per-attribute definitions"
+        values = {param: float(reference(beam, param)) for param in params}
+    else:
+        beam, source = Beams.beam(), "SimulationFramework"
+        beam.read_HDF5_beam_file(beam_file)
+        values = {param: float(getattr(beam, param)) for param in params}
+    with open(reference_file, "w") as f:
+        json.dump({"source": source, "values": values}, f, indent=1)
+        f.write("\n")
+    print(f"Reference values from {source} written to {reference_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""``beam_statistics`` must give the values of the per-attribute beam path.
+
+``data/beam.hdf5`` is a small SimFrame beam file whose statistics are stored in
+``data/beam_reference.json`` by ``make_beam_reference.py``. The SimFrame
+comparison runs on it and on the beam files listed in ``SIMFRAME_TEST_BEAMS``
+(separated by ``os.pathsep``), and is skipped without SimulationFramework.
+"""
+
+import os
+import json
+import types
+import numpy as np
+import pytest
+from helpers import load_module
+from make_beam_reference import beam_file, read_beam, reference, reference_file
+
+beam_statistics = load_module("beam_statistics", "interfaces", "SimFrame", "beam_statistics.py")
+me = beam_statistics.electron_rest_energy
+
+
+def _beam(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(1e-4, 1e-3, n)
+    cpx = 2e3 * x / 1e-3 + rng.normal(0, 1e3, n)
+    y = rng.normal(0, 5e-4, n)
+    cpy = rng.normal(0, 5e2, n) - 1e3 * y / 5e-4
+    z = rng.normal(0, 1e-3, n)
+    cpz = rng.normal(35e6, 1e4, n) + 2e9 * z
+    charge = rng.uniform(0.5, 1.5, n) * 250e-12 / n
+    return types.SimpleNamespace(x=x, y=y, z=z, t=z / 3e8, cpx=cpx, cpy=cpy, cpz=cpz, charge=charge, Q=charge.sum())
+
+
+def test_matches_per_attribute_definitions():
+    beam = _beam()
+    values = beam_statistics.beam_statistics(beam)
+    assert values
+    for param, value in values.items():
+        assert value == pytest.approx(reference(beam, param), rel=1e-9), param
+
+
+def test_matches_fixture_reference():
+    with open(reference_file) as f:
+        expected = json.load(f)["values"]
+    values = beam_statistics.beam_statistics(read_beam(), list(expected))
+    for param, value in expected.items():
+        assert values[param] == pytest.approx(value, rel=1e-9), param
+
+
+def test_unsupported_statistics_fall_back_to_the_beam():
+    beam = _beam()
+    beam.linear_chirp_z = -3.5
+    beam.peak_current = 120.0
+    values = beam_statistics.beam_statistics(beam, ["linear_chirp_z", "peak_current"])
+    assert values == {"linear_chirp_z": -3.5, "peak_current": 120.0}
+
+
+@pytest.mark.parametrize(
+    "filename", [beam_file] + [f for f in os.environ.get("SIMFRAME_TEST_BEAMS", "").split(os.pathsep) if f]
+)
+def test_matches_simframe(filename):
+    Beams = pytest.importorskip("SimulationFramework.Modules.Beams")
+    simframe_beam = Beams.beam()
+    simframe_beam.read_HDF5_beam_file(filename)
+    values = beam_statistics.beam_statistics(simframe_beam)
+    for param, value in values.items():
+        assert value == pytest.approx(float(getattr(simframe_beam, param)), rel=1e-6), param
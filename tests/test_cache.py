@@ -0,0 +1,50 @@
+"""Tracking results are keyed on the lattice files as well as the settings file name."""
+
+import os
+import pytest
+from helpers import load_module
+
+cache = load_module("simframe_cache", "interfaces", "SimFrame", "cache.py")
+
+
+@pytest.fixture
+def settings(tmp_path):
+    (tmp_path / "lattice").mkdir()
+    (tmp_path / "FEBE.def").write_text(
+        "files:\n  FEBE:\n    elements:\n      filename: [lattice/FEBE.yaml]\n"
+    )
+    (tmp_path / "lattice" / "FEBE.yaml").write_text("elements:\n  Q1: {file: quad.lte}\n")
+    (tmp_path / "lattice" / "quad.lte").write_text("Q1: KQUAD, L=0.1\n")
+    return tmp_path
+
+
+def _touch(path, content):
+    path.write_text(content)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_includes_are_followed(settings):
+    fingerprint = cache.settings_fingerprint("./FEBE.def", str(settings))
+    assert set(cache._scans[("./FEBE.def", str(settings))]) == {
+        str(settings / "FEBE.def"),
+        str(settings / "lattice" / "FEBE.yaml"),
+        str(settings / "lattice" / "quad.lte"),
+    }
+    assert cache.settings_fingerprint("./FEBE.def", str(settings)) == fingerprint
+
+
+@pytest.mark.parametrize("name", ["FEBE.def", "lattice/FEBE.yaml", "lattice/quad.lte"])
+def test_edits_change_the_key(settings, name):
+    before = cache.cache_key({"Q1:k1": 1.0}, settings_files=cache.settings_fingerprint("FEBE.def", str(settings)))
+    _touch(settings / name, (settings / name).read_text() + "\n")
+    after = cache.cache_key({"Q1:k1": 1.0}, settings_files=cache.settings_fingerprint("FEBE.def", str(settings)))
+    assert before != after
+
+
+def test_new_include_is_picked_up(settings):
+    before = cache.settings_fingerprint("FEBE.def", str(settings))
+    (settings / "lattice" / "extra.lte").write_text("D1: DRIF, L=1\n")
+    _touch(settings / "lattice" / "FEBE.yaml", "elements:\n  Q1: {file: quad.lte}\n  D1: {file: extra.lte}\n")
+    assert cache.settings_fingerprint("FEBE.def", str(settings)) != before
+    assert str(settings / "lattice" / "extra.lte") in cache._scans[("FEBE.def", str(settings))]
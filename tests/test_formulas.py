@@ -0,0 +1,73 @@
+"""Compiled formulas must give what ``badger.formula.interpret_expression`` gives, errors included."""
+
+import numpy as np
+import pytest
+from helpers import load_module
+
+badger_formula = pytest.importorskip("badger.formula")
+formulas = load_module("formulas", "environments", "formulas.py")
+
+ufuncs = sorted(name for name in dir(np) if isinstance(getattr(np, name), np.ufunc))
+functions = [
+    f"{name}(`x`)" if getattr(np, name).nin == 1 else f"{name}(`x`, `y`)" for name in ufuncs
+] + [
+    "rms(`x`)",
+    "percentile80(`x`)",
+    "percentile(`x`, 20)",
+    "mean(`x`)",
+    "median(`x`)",
+    "std(`x`)",
+    "var(`x`)",
+    "average(`x`)",
+    "prod(`x`)",
+    "ptp(`x`)",
+    "cbrt(`x`)",
+    "sum(`x`)",
+    "len(`x`)",
+    "min(`x`)",
+    "max(`x`)",
+    "min(`x`, `y`)",
+    "max(`x`, `y`)",
+    "abs(`y`)",
+    "round(`y`, 2)",
+    "pi * e * `y`",
+    "1e6 * abs(`a:b`) / `y`",
+]
+failures = ["rms", "`missing` + 1", "typo(`y`)", "`y` +", "__import__('os')", "`y`.__class__"]
+values = [
+    {"x": 0.7, "y": -1.25, "a:b": 3.0, "x:y": 2.0},
+    {"x": np.array([0.2, 0.5, 0.9]), "y": 0.3, "a:b": -2.0, "x:y": 1.0},
+]
+
+
+def _outcome(function, *args):
+    try:
+        return "value", function(*args)
+    except Exception as e:
+        return type(e).__name__, str(e)
+
+
+@pytest.mark.parametrize("observables", values)
+@pytest.mark.parametrize("expression", functions + failures)
+def test_matches_interpret_expression(expression, observables):
+    with np.errstate(all="ignore"):
+        expected = _outcome(badger_formula.interpret_expression, expression, observables)
+        actual = _outcome(formulas.Formula(expression), observables)
+    assert actual[0] == expected[0]
+    if expected[0] == "value":
+        np.testing.assert_equal(actual[1], expected[1])
+    else:
+        assert actual[1] == expected[1]
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["1e-6 * `x`", "100 * `x` / `y`", "sqrt(`x`) + abs(`y`)", "max(`x`, `y`)", "rms(`x`)", "percentile50(`x`)"],
+)
+def test_batch_matches_single_points(expression):
+    rng = np.random.default_rng(0)
+    points = [{"x": float(x), "y": float(y)} for x, y in rng.uniform(0.1, 2.0, (16, 2))]
+    formula = formulas.Formula(expression)
+    np.testing.assert_allclose(
+        formula.batch(points), [float(badger_formula.interpret_expression(expression, p)) for p in points]
+    )
@@ -0,0 +1,83 @@
+"""The vectorised ``otsu`` must threshold exactly as the original per-threshold loop did."""
+
+import os
+import sys
+import numpy as np
+import pytest
+from helpers import root
+
+scale = 256
+
+
+@pytest.fixture(scope="module")
+def image_analysis():
+    sys.path[:0] = [os.path.join(root, "interfaces", "CATAP"), root]
+    try:
+        import image_analysis
+
+        yield image_analysis
+    finally:
+        del sys.path[:2]
+
+
+def otsu_loop(gray, scale: float = 2**16):
+    # The implementation replaced by the cumulative-sum version, kept as the reference
+    pixel_number = gray.shape[0] * gray.shape[1]
+    mean_weight = 1.0 / pixel_number
+    his, bins = np.histogram(gray, np.arange(0, scale))
+    final_thresh = -1
+    final_value = -1
+    intensity_arr = np.arange(scale - 1)
+    for t in bins[2:-1]:
+        pcb = np.sum(his[:t])
+        pcf = np.sum(his[t:])
+        Wb = pcb * mean_weight
+        Wf = pcf * mean_weight
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mub = np.sum(intensity_arr[:t] * his[:t]) / float(pcb)
+            muf = np.sum(intensity_arr[t:] * his[t:]) / float(pcf)
+        value = Wb * Wf * (mub - muf) ** 2
+
+        if value > final_value:
+            final_thresh = t
+            final_value = value
+    final_img = gray.copy()
+    final_img[gray > final_thresh] = scale
+    final_img[gray < final_thresh] = final_thresh
+    return final_img
+
+
+def _image(seed, shape=(24, 32), dtype=float):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[: shape[0], : shape[1]]
+    centre = rng.uniform(0.3, 0.7, 2) * shape
+    spot = rng.uniform(60, 200) * np.exp(
+        -((y - centre[0]) ** 2 / rng.uniform(4, 30) + (x - centre[1]) ** 2 / rng.uniform(4, 30))
+    )
+    image = np.clip(spot + rng.normal(rng.uniform(5, 30), 4, shape), 0, scale - 1.5)
+    return image.astype(dtype) if dtype is not float else image
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("dtype", [np.uint16, np.int32, float])
+def test_matches_loop(image_analysis, seed, dtype):
+    image = _image(seed, dtype=dtype)
+    np.testing.assert_array_equal(image_analysis.otsu(image, scale=scale), otsu_loop(image, scale=scale))
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, float])
+def test_stack_matches_loop_per_frame(image_analysis, dtype):
+    stack = np.stack([_image(seed, dtype=dtype) for seed in range(5)])
+    expected = np.stack([otsu_loop(frame, scale=scale) for frame in stack])
+    np.testing.assert_array_equal(image_analysis.otsu(stack, scale=scale), expected)
+
+
+def test_flat_and_two_level_images(image_analysis):
+    # Float only: with no threshold the loop writes -1 into the image, which unsigned types reject
+    for image in (
+        np.full((8, 8), 7.0),
+        np.zeros((8, 8)),
+        np.where(np.eye(8, dtype=bool), 200.0, 10.0),
+    ):
+        np.testing.assert_array_equal(image_analysis.otsu(image, scale=scale), otsu_loop(image, scale=scale))
@@ -0,0 +1,67 @@
+"""Monitored PVs stay fresh while connected; max_age only applies once the monitor is lost."""
+
+import sys
+import types
+import pytest
+from helpers import load_module
+
+pv_cache = load_module("pv_cache", "interfaces", "CATAP", "pv_cache.py")
+
+
+class FakePV:
+    def __init__(self, pvname, auto_monitor=True, callback=None, connection_callback=None):
+        self.pvname = pvname
+        self.callback = callback
+        self.connection_callback = connection_callback
+        self.connected = False
+
+    def connect(self, value):
+        self.connected = True
+        self.connection_callback(pvname=self.pvname, conn=True)
+        self.callback(pvname=self.pvname, value=value)
+
+    def disconnect(self):
+        self.connected = False
+        self.connection_callback(pvname=self.pvname, conn=False)
+
+    def clear_callbacks(self):
+        pass
+
+
+@pytest.fixture
+def monitors(monkeypatch):
+    monkeypatch.setitem(sys.modules, "epics", types.SimpleNamespace(PV=FakePV))
+    clock = [1000.0]
+    monkeypatch.setattr(pv_cache, "time", types.SimpleNamespace(time=lambda: clock[0]))
+    cache = pv_cache.MonitorCache(max_age=2.0)
+    cache.monitor(["MAG-01:GETSETI"])
+    return cache, cache._pvs["MAG-01:GETSETI"], clock
+
+
+def test_connected_monitor_never_expires(monitors):
+    cache, pv, clock = monitors
+    assert cache.get("MAG-01:GETSETI") is None
+    pv.connect(3.5)
+    clock[0] += 3600
+    assert cache.get("MAG-01:GETSETI") == 3.5
+
+
+def test_disconnected_value_ages_out(monitors):
+    cache, pv, clock = monitors
+    pv.connect(3.5)
+    clock[0] += 1
+    pv.disconnect()
+    assert cache.get("MAG-01:GETSETI") == 3.5
+    clock[0] += 2
+    assert cache.get("MAG-01:GETSETI") is None
+
+
+def test_read_values_age_out(monitors):
+    cache, pv, clock = monitors
+    cache.update({"MAG-01:GETSETI": 1.0, "MAG-02:GETSETI": 2.0})
+    clock[0] += 1
+    assert cache.get("MAG-01:GETSETI") == 1.0
+    assert cache.get("MAG-02:GETSETI") == 2.0
+    clock[0] += 2
+    assert cache.get("MAG-01:GETSETI") is None
+    assert cache.get("MAG-02:GETSETI") is None